@@ -0,0 +1,223 @@
+"""Times the hot paths of docphp.py on a synthetic pack, without Sublime Text
+
+    python3 bench/benchmark.py                  # compare with bench/baseline.json
+    python3 bench/benchmark.py --save-baseline  # record this machine's numbers
+
+Exits with status 1 when a median or the peak memory regressed by more
+than the tolerance against the baseline.
+"""
+
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+benchPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchPath))
+sys.path.insert(0, os.path.join(os.path.dirname(benchPath), 'headless'))
+
+import sublime
+import synthetic
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+languageName = 'xx'
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def measure(results, name, samples):
+    results[name] = {
+        "count": len(samples),
+        "p50": percentile(samples, 0.5) * 1000,
+        "p90": percentile(samples, 0.9) * 1000,
+        "p99": percentile(samples, 0.99) * 1000,
+        "max": max(samples) * 1000,
+    }
+
+
+def timed(callback, *args):
+    begin = time.perf_counter()
+    callback(*args)
+    return time.perf_counter() - begin
+
+
+def getPeakMemory():
+    if not resource:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def configure(docphp):
+    settings = sublime.load_settings(docphp.setting_file)
+    settings.set('language', languageName)
+    settings.set('languages', {languageName: 'gz'})
+    settings.set('language_fallback', False)
+    settings.set('search_index', False)
+    settings.set('prefetch', False)
+    settings.set('render_cache_size', 0)
+    settings.set('language_idle_unload', 0)
+    settings.set('debug', False)
+    docphp.currentSettings = settings
+    docphp.currentView = sublime.View()
+    docphp.language = languageName
+
+
+def unload(docphp):
+    docphp.docphp_languages.pop(languageName, None)
+    docphp.languageLoads.pop(languageName, None)
+    for pair in list(docphp.resolutionTables.keys()):
+        if languageName in pair:
+            del docphp.resolutionTables[pair]
+    docphp.closeLanguageFiles(languageName)
+
+
+def run(args):
+    cachePath = args.cache or tempfile.mkdtemp(prefix='docphp-bench-')
+    sublime.cachePath = cachePath
+    import docphp
+    configure(docphp)
+
+    languagePath = docphp.getDocphpPath() + 'language/'
+    if not os.path.isdir(languagePath):
+        os.makedirs(languagePath)
+    begin = time.perf_counter()
+    pages = synthetic.build(docphp.getTarGzPath(languageName), args.pages, args.sections, args.seed)
+    print('generated %d pages, %.1f MB in %.1fs' % (
+        len(pages), os.path.getsize(docphp.getTarGzPath(languageName)) / 1048576.0, time.perf_counter() - begin))
+
+    symbols = [pageId for pageId, name in random.Random(args.seed).sample(pages, min(args.samples, len(pages)))]
+    results = {}
+    try:
+        samples = []
+        for repeat in range(args.cold):
+            unload(docphp)
+            shutil.rmtree(docphp.getI18nCachePath(languageName), True)
+            samples.append(timed(docphp.loadLanguage, languageName))
+        measure(results, 'loadLanguage cold', samples)
+
+        samples = []
+        for repeat in range(args.repeat):
+            unload(docphp)
+            samples.append(timed(docphp.loadLanguage, languageName))
+        measure(results, 'loadLanguage warm', samples)
+
+        descriptions = {}
+
+        def describe(symbol):
+            docphp.language = languageName
+            descriptions[symbol] = docphp.getSymbolDescription(symbol)[1]
+
+        measure(results, 'getSymbolDescription cold', [timed(describe, symbol) for symbol in symbols])
+        measure(results, 'getSymbolDescription warm', [timed(describe, symbol) for symbol in symbols])
+        measure(results, 'formatPopup', [timed(docphp.formatPopup, descriptions[symbol], symbol) for symbol in symbols])
+
+        def formatPanel(symbol):
+            docphp.docphp_languages[languageName]["panels"].discard(symbol)
+            return ''.join(docphp.formatPanelChunks(descriptions[symbol], symbol, languageName))
+
+        measure(results, 'formatPanelChunks', [timed(formatPanel, symbol) for symbol in symbols])
+
+        command = docphp.DocphpSearchCommand(sublime.View())
+
+        def buildSearchList():
+            docphp.docphp_languages[languageName].pop("searchPanel", None)
+            command.run(None)
+
+        samples = []
+        for repeat in range(args.repeat):
+            gc.collect()
+            samples.append(timed(buildSearchList))
+        measure(results, 'DocphpSearchCommand list', samples)
+    finally:
+        unload(docphp)
+        if not args.cache:
+            shutil.rmtree(cachePath, True)
+
+    return results, getPeakMemory()
+
+
+def report(results, memory, baseline, tolerance):
+    regressions = []
+    print('%-28s %6s %10s %10s %10s %10s %10s' % ('', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'baseline'))
+    for name in sorted(results):
+        result = results[name]
+        expected = baseline.get("results", {}).get(name, {}).get("p50")
+        mark = ''
+        if expected:
+            change = result["p50"] / expected - 1
+            mark = '%+.0f%%' % (change * 100)
+            if change > tolerance:
+                regressions.append('%s median %.3f ms, baseline %.3f ms' % (name, result["p50"], expected))
+                mark += ' !!'
+        print('%-28s %6d %10.3f %10.3f %10.3f %10.3f %10s' % (
+            name, result["count"], result["p50"], result["p90"], result["p99"], result["max"], mark))
+
+    if memory is not None:
+        expected = baseline.get("memory")
+        print('peak memory %.1f MB%s' % (memory, ', baseline %.1f MB' % expected if expected else ''))
+        if expected and memory / expected - 1 > tolerance:
+            regressions.append('peak memory %.1f MB, baseline %.1f MB' % (memory, expected))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark docphp.py on a synthetic manual')
+    parser.add_argument('--pages', type=int, default=3000, help='pages in the synthetic pack')
+    parser.add_argument('--sections', type=int, default=6, help='most sections on a page, about 1.5 KB each')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--samples', type=int, default=300, help='pages looked up and rendered')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of the warm load and the search list')
+    parser.add_argument('--cold', type=int, default=3, help='runs of the cold load, each rebuilds the caches')
+    parser.add_argument('--cache', help='keep the pack and caches in this directory instead of a temporary one')
+    parser.add_argument('--baseline', default=os.path.join(benchPath, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed slowdown, 0.3 is 30%%')
+    args = parser.parse_args()
+
+    results, memory = run(args)
+
+    baseline = {}
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        with open(args.baseline, 'r', encoding='utf8') as f:
+            baseline = sublime.decode_value(f.read())
+        for option in ['pages', 'sections', 'seed', 'samples']:
+            if baseline.get(option) != getattr(args, option):
+                print('baseline was recorded with --%s %s, the comparison is meaningless' % (option, baseline.get(option)))
+
+    regressions = report(results, memory, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf8') as f:
+            f.write(sublime.encode_value({
+                "pages": args.pages,
+                "sections": args.sections,
+                "seed": args.seed,
+                "samples": args.samples,
+                "results": results,
+                "memory": memory,
+            }, True))
+        print('baseline saved to ' + args.baseline)
+    elif not baseline:
+        print('no baseline at %s, record one with --save-baseline' % args.baseline)
+
+    if regressions:
+        print('\nREGRESSION')
+        for regression in regressions:
+            print('  ' + regression)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
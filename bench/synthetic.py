@@ -0,0 +1,180 @@
+"""Generates php_manual_xx.tar.gz packs shaped like the php.net ones
+
+    python3 bench/synthetic.py php_manual_xx.tar.gz --pages 12000 --sections 6
+"""
+
+import argparse
+import io
+import random
+import tarfile
+
+page = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml"><head><meta http-equiv="content-type" content="text/html; charset=UTF-8"><title>%(title)s</title></head><body><div class="manualnavbar" style="text-align: center;">
+ <div class="prev" style="text-align: left; float: left;"><a href="%(prev)s.html">%(prev)s</a></div>
+ <div class="next" style="text-align: right; float: right;"><a href="%(next)s.html">%(next)s</a></div>
+ <div class="up"><a href="ref.%(word)s.html">%(word)s Functions</a></div>
+ <div class="home"><a href="index.html">PHP Manual</a></div>
+</div><hr /><div id="%(id)s" class="refentry">
+ <div class="refnamediv">
+  <h1 class="refname">%(name)s</h1>
+  <p class="verinfo">(PHP 4, PHP 5, PHP 7)</p><p class="refpurpose"><span class="refname">%(name)s</span> &mdash; <span class="dc-title">%(title)s</span></p>
+ </div>
+ <div class="refsect1 description" id="refsect1-%(id)s-description">
+  <h3 class="title">Description</h3>
+  <div class="methodsynopsis dc-description">
+   <span class="type">int</span> <span class="methodname"><strong>%(name)s</strong></span>
+    ( <span class="methodparam"><span class="type">string</span> <code class="parameter">$string</code></span>
+   )</div>
+  <p class="para rdfs-comment">Returns the %(word)s of the given <code class="parameter">string</code>.<br>
+  See <a href="function.strlen.html" class="function">strlen()</a> &amp; <em>friends</em> &raquo; &quot;quoted&quot; &#039;single&#039; &copy; &nbsp;&eacute;</p>
+ </div>
+%(sections)s
+</div><hr /><div class="manualnavbar" style="text-align: center;">
+ <div class="prev" style="text-align: left; float: left;"><a href="%(prev)s.html">%(prev)s</a></div>
+</div></body></html>
+'''
+
+listPage = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml"><head><meta http-equiv="content-type" content="text/html; charset=UTF-8"><title>%(name)s</title></head><body><div class="manualnavbar" style="text-align: center;">
+ <div class="prev" style="text-align: left; float: left;"><a href="%(prev)s.html">%(prev)s</a></div>
+ <div class="next" style="text-align: right; float: right;"><a href="%(next)s.html">%(next)s</a></div>
+ <div class="up"><a href="index.html">PHP Manual</a></div>
+ <div class="home"><a href="index.html">PHP Manual</a></div>
+</div><hr /><div id="%(id)s" class="%(kind)s">
+ <h1 class="title">%(name)s</h1>
+%(list)s
+</div><hr /><div class="manualnavbar" style="text-align: center;">
+ <div class="prev" style="text-align: left; float: left;"><a href="%(prev)s.html">%(prev)s</a></div>
+</div></body></html>
+'''
+
+section = ''' <div class="refsect1 examples" id="refsect1-%(id)s-%(number)d">
+  <h3 class="title">Section %(number)d</h3>
+  <div class="example" id="example-%(number)d"><p><strong>Example #%(number)d A %(name)s example</strong></p>
+   <div class="example-contents"><div class="phpcode"><code><span style="color: #000000"><br />&lt;?php<br />$str&nbsp;=&nbsp;'abcdef';<br />echo&nbsp;%(name)s($str);&nbsp;//&nbsp;6<br />?&gt;</span></code></div></div>
+  </div>
+  <div class="tip"><strong class="tip">Tip</strong><p class="para">Use <strong><code>%(constant)s</code></strong> with $x &$y.</p></div>
+  <table class="doctable informaltable"><thead><tr><th>Flag</th><th>Description</th></tr></thead>
+  <tbody class="tbody"><tr id="constant.%(constantId)s"><td><strong><code>%(constant)s</code></strong></td><td>Some text &lt;here&gt; with &hellip;</td></tr></tbody></table>
+  <ul class="simplelist"><li class="member"><a href="function.%(word)s-%(number)d.html" class="function">%(word)s_%(number)d()</a></li></ul>
+  <div class="warning"><strong class="warning">Warning</strong><p class="para">Careful with <span class="type">mixed</span>.</p></div>
+ </div>
+'''
+
+# The contents of book and set pages
+chunklist = ' <ul class="chunklist chunklist_%(kind)s">%(items)s</ul>'
+chunk = '<li><a href="%(id)s.html">%(name)s</a>%(children)s</li>'
+chunkChildren = '<ul class="chunklist chunklist_%(kind)s chunklist_children">%(items)s</ul>'
+# The contents of the indexes.functions page
+genIndex = " <ul class='gen-index index-for-refentry'>%(letters)s</ul>"
+genIndexLetter = "<li class='gen-index index-for-%(letter)s'>%(letter)s<ul id='refentry-index-for-%(letter)s'>\n%(items)s</ul></li>"
+genIndexItem = '<li><a href="%(id)s.html" class="index">%(name)s</a> - Does %(name)s things</li>\n'
+
+words = ['str', 'array', 'preg', 'mb', 'date', 'json', 'file', 'stream', 'curl', 'hash', 'math', 'intl', 'socket']
+
+
+def getPages(count, seed=1):
+    """Returns (page id, name) pairs in the proportions of the real manual"""
+    generator = random.Random(seed)
+    pages = [
+        ('index', 'PHP Manual'),
+        ('function.strlen', 'strlen'),
+        ('book.strings', 'Strings'),
+        ('indexes.functions', 'List of Functions and Methods'),
+        ('class.datetime', 'DateTime'),
+        ('datetime.format', 'DateTime::format'),
+        ('datetime.createfromformat', 'DateTime::createFromFormat'),
+    ]
+    className = None
+    while len(pages) < count:
+        number = len(pages)
+        word = generator.choice(words)
+        kind = generator.random()
+        if kind < 0.6:
+            pages.append(('function.%s-f%d' % (word, number), '%s_f%d' % (word, number)))
+        elif kind < 0.7 or not className:
+            className = '%s%d' % (word, number)
+            pages.append(('class.' + className, className))
+        elif kind < 0.95:
+            pages.append(('%s.method%d' % (className, number), '%s::method%d' % (className, number)))
+        else:
+            pages.append(('book.%s%d' % (word, number), '%s%d' % (word, number)))
+    return pages
+
+
+def getPage(pageId, name, sections, word='str', prev='index', next='index'):
+    return page % {
+        "id": pageId,
+        "name": name,
+        "title": 'Does %s things' % name,
+        "word": word,
+        "prev": prev,
+        "next": next,
+        "sections": ''.join(section % {
+            "id": pageId,
+            "number": number,
+            "name": name,
+            "word": word,
+            "constant": '%s_FLAG_%d' % (pageId.replace('.', '_').replace('-', '_').upper(), number),
+            "constantId": '%s-flag-%d' % (pageId.replace('.', '-'), number),
+        } for number in range(sections)),
+    }
+
+
+def getListPage(pageId, name, pages, generator, size, prev='index', next='index'):
+    """A book or the index as php.net has them, a list of the chapters with
+    the pages in each, or the index of every function by its first letter"""
+    if pageId == 'indexes.functions':
+        letters = {}
+        for page in sorted(pages, key=lambda page: page[1].lower()):
+            if page[0].startswith('function.'):
+                letters.setdefault(page[1][0].lower(), []).append(genIndexItem % {"id": page[0], "name": page[1]})
+        content = genIndex % {"letters": ''.join(genIndexLetter % {
+            "letter": letter, "items": ''.join(letters[letter])} for letter in sorted(letters))}
+        kind = 'section'
+    else:
+        kind = 'set' if pageId == 'index' else 'book'
+        items = []
+        for chapter in generator.sample(pages, min(len(pages), size)):
+            children = generator.sample(pages, generator.randint(0, 8))
+            items.append(chunk % {
+                "id": chapter[0],
+                "name": chapter[1],
+                "children": chunkChildren % {"kind": kind, "items": ''.join(
+                    chunk % {"id": child[0], "name": child[1], "children": ''} for child in children)} if children else '',
+            })
+        content = chunklist % {"kind": kind, "items": ''.join(items)}
+    return listPage % {"id": pageId, "name": name, "kind": kind, "prev": prev, "next": next, "list": content}
+
+
+def build(path, count=3000, sections=6, seed=1):
+    """Writes a pack of count pages, each with 1 to sections sections of
+    about 1.5 KB, the index, book and function index pages are long lists"""
+    generator = random.Random(seed)
+    pages = getPages(count, seed)
+    with tarfile.open(path, 'w:gz') as tar:
+        for number, (pageId, name) in enumerate(pages):
+            prev, next = pages[number - 1][0], pages[(number + 1) % len(pages)][0]
+            if pageId in ('index', 'indexes.functions') or pageId.startswith('book.'):
+                data = getListPage(pageId, name, pages, generator, sections * 60, prev, next).encode('utf8')
+            else:
+                data = getPage(pageId, name, generator.randint(1, sections), generator.choice(words),
+                               prev, next).encode('utf8')
+            info = tarfile.TarInfo('php-chunked-xhtml/' + pageId + '.html')
+            info.size = len(data)
+            info.mtime = 1500000000
+            tar.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('php-chunked-xhtml/images/logo.png')
+        info.size = 3
+        tar.addfile(info, io.BytesIO(b'png'))
+    return pages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic PHP manual pack')
+    parser.add_argument('path')
+    parser.add_argument('--pages', type=int, default=3000)
+    parser.add_argument('--sections', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    build(args.path, args.pages, args.sections, args.seed)
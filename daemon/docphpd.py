@@ -0,0 +1,313 @@
+"""Serves docphp.py lookups over a Unix socket, so several Sublime Text
+instances on a host share one warm index and render cache per language
+
+    python3 daemon/docphpd.py serve --cache ~/.config/sublime-text-3/Cache
+    python3 daemon/docphpd.py lookup strlen --language en
+    python3 daemon/docphpd.py load --clients 8 --requests 200
+    python3 daemon/docphpd.py prebuild --languages en de
+
+The plugin finds the socket in its cache directory, or at its
+daemon_socket setting, and looks up in process when nothing answers.
+Requests and responses are JSON objects, one per line.
+
+prebuild renders the whole manual into the prebuilt cache on all cores.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+daemonPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(daemonPath))
+sys.path.insert(0, os.path.join(os.path.dirname(daemonPath), 'headless'))
+
+import sublime
+
+docphp = None
+# The engine keeps its language in module globals, so requests take turns
+engineLock = threading.Lock()
+
+
+def getDefaultCachePath():
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/Sublime Text 3')
+    return os.path.expanduser('~/.config/sublime-text-3/Cache')
+
+
+def loadEngine(cachePath, socketPath=False):
+    global docphp
+    sublime.cachePath = cachePath
+    import docphp
+    settings = sublime.load_settings(docphp.setting_file)
+    # "" is the default socket, the daemon itself never asks one
+    settings.set('daemon_socket', socketPath)
+    docphp.currentSettings = settings
+    docphp.currentView = sublime.View()
+    return docphp
+
+
+def configure(request):
+    settings = docphp.currentSettings
+    languages = request.get("languages") or [request["language"]]
+    settings.set('language', request["language"])
+    settings.set('language_fallback', request.get("fallback") or False)
+    settings.set('languages', dict((name, 'gz') for name in languages))
+    docphp.language = request["language"]
+
+
+def handle(request):
+    op = request.get("op")
+    if op == 'ping':
+        return {"pid": os.getpid(), "languages": sorted(docphp.docphp_languages)}
+    if op == 'stats':
+        return {"report": docphp.getPerformanceReport()}
+    if op not in ('popup', 'panel', 'symbols'):
+        return {"error": 'unknown op ' + str(op)}
+
+    with engineLock:
+        configure(request)
+        if op == 'symbols':
+            if not docphp.waitForLanguage(docphp.language):
+                return {"error": 'language not installed'}
+            return {"symbols": sorted(docphp.docphp_languages[docphp.language]["symbolList"].keys())}
+        language, symbol, output, found = docphp.renderSymbol(
+            request["symbol"], request.get("can_back", False), request.get("part", 0), op == 'panel')
+    return {"language": language, "symbol": symbol, "output": output, "found": found}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = handle(sublime.decode_value(line.decode('utf8')))
+            except Exception as e:
+                response = {"error": '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write((sublime.encode_value(response) + '\n').encode('utf8'))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+    # Connecting to a Unix socket with a full backlog fails rather than waits
+    request_queue_size = 128
+
+
+def serve(args):
+    socketPath = args.socket or os.path.join(args.cache, 'DocPHPManualer', 'docphpd.sock')
+    loadEngine(args.cache)
+    for languageName in args.preload:
+        docphp.loadLanguage(languageName)
+
+    if os.path.exists(socketPath):
+        # A dead daemon leaves its socket behind, a live one answers
+        docphp.currentSettings.set('daemon_socket', socketPath)
+        if docphp.daemonRequest({"op": "ping"}):
+            sys.exit('a daemon already listens on ' + socketPath)
+        docphp.currentSettings.set('daemon_socket', False)
+        os.unlink(socketPath)
+
+    server = Server(socketPath, RequestHandler)
+    os.chmod(socketPath, int(args.mode, 8))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('listening on ' + socketPath)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socketPath):
+            os.unlink(socketPath)
+
+
+def configureClient(args):
+    loadEngine(args.cache, args.socket or '')
+    configure({
+        "language": args.language,
+        "fallback": args.fallback,
+        "languages": [args.language] + ([args.fallback] if args.fallback else []),
+    })
+
+
+def lookup(args):
+    configureClient(args)
+    op = 'popup' if args.popup else 'panel'
+    response = docphp.daemonRequest({"op": op, "symbol": args.symbol})
+    if response and response["found"] is not False:
+        found, output = response["found"], response["output"]
+    else:
+        print('no daemon, looking up in process', file=sys.stderr)
+        language, symbol, output, found = docphp.renderSymbol(args.symbol, panel=not args.popup)
+    if not found:
+        sys.exit('not found' if found is None else args.language + ' is not installed')
+    print(output)
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def load(args):
+    configureClient(args)
+    response = docphp.daemonRequest({"op": "symbols"})
+    if not response:
+        sys.exit('no daemon answers on ' + str(docphp.getDaemonSocketPath()))
+    symbols = random.Random(args.seed).sample(response["symbols"], min(args.requests, len(response["symbols"])))
+    samples = []
+    failures = []
+
+    def client(number):
+        for symbol in symbols[number::args.clients]:
+            begin = time.perf_counter()
+            response = docphp.daemonRequest({"op": args.op, "symbol": symbol})
+            if response is None:
+                failures.append(symbol)
+            else:
+                samples.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+
+    print('%d requests from %d clients in %.2fs, %.0f/s, %d failed' % (
+        len(samples), args.clients, elapsed, len(samples) / elapsed, len(failures)))
+    if samples:
+        print('latency ms: p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % tuple(
+            percentile(samples, fraction) * 1000 for fraction in (0.5, 0.9, 0.99, 1)))
+    if failures:
+        sys.exit(1)
+
+
+def getInstalledLanguages(cachePath):
+    languagePath = os.path.join(cachePath, 'DocPHPManualer', 'language')
+    if not os.path.isdir(languagePath):
+        return []
+    return sorted(name[len('php_manual_'):-len('.tar.gz')] for name in os.listdir(languagePath)
+                  if name.startswith('php_manual_') and name.endswith('.tar.gz'))
+
+
+def configurePrebuild(cachePath, languages):
+    loadEngine(cachePath)
+    configure({"language": languages[0], "languages": languages})
+    # A search index thread holding a lock when the pool forks would leave
+    # the lock held in the workers, the index is built at the end instead
+    docphp.currentSettings.set('search_index', False)
+
+
+def initPrebuild(cachePath, languages):
+    # Forked workers would share the file offsets of the parent's stores
+    configurePrebuild(cachePath, languages)
+    for path in list(docphp.openfiles):
+        docphp.openfiles.pop(path).close()
+    docphp.docphp_languages.clear()
+    for languageName in languages:
+        docphp.loadLanguage(languageName)
+
+
+def prebuildWorker(job):
+    return docphp.prebuildBatch(*job)
+
+
+def prebuild(args):
+    languages = args.languages or getInstalledLanguages(args.cache)
+    if not languages:
+        sys.exit('no language is installed in ' + args.cache)
+    configurePrebuild(args.cache, languages)
+
+    jobs = []
+    total = done = 0
+    for languageName in languages:
+        # Stores and indexes are built here once rather than by every worker
+        if not docphp.loadLanguage(languageName):
+            sys.exit(languageName + ' is not installed')
+        count = len(docphp.getSymbolIndex(languageName))
+        batches = docphp.getPrebuildBatches(languageName)
+        total += count
+        done += count - sum(min(docphp.prebuildBatchSize, count - number * docphp.prebuildBatchSize) for number in batches)
+        jobs.extend((languageName, number) for number in batches)
+    if done:
+        print('resuming, %d of %d pages are prebuilt' % (done, total))
+
+    processes = args.processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, initPrebuild, (args.cache, languages))
+    begin = time.time()
+    pages = 0
+    try:
+        for count in pool.imap_unordered(prebuildWorker, jobs):
+            pages += count
+            elapsed = time.time() - begin
+            rate = pages / elapsed
+            sys.stdout.write('\r%d/%d pages, %.0f pages/s, %.0fs left   ' % (
+                done + pages, total, rate, (total - done - pages) / rate))
+            sys.stdout.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.exit('\ninterrupted, run again to resume')
+    finally:
+        pool.join()
+
+    print()
+    for languageName in languages:
+        print('search index of ' + languageName)
+        docphp.getSearchIndex(languageName).build()
+
+    prebuiltPath = docphp.getPrebuiltPath()
+    size = sum(os.path.getsize(prebuiltPath + name) for name in os.listdir(prebuiltPath))
+    print('prebuilt %d pages with %d processes in %.1fs, %.1f MB in %s' % (
+        pages, processes, time.time() - begin, size / 1048576.0, prebuiltPath))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared lookup daemon for DocPHPManualer')
+    parser.add_argument('--cache', default=getDefaultCachePath(), help='the Sublime Text cache directory')
+    parser.add_argument('--socket', help='defaults to DocPHPManualer/docphpd.sock in the cache directory')
+    parser.add_argument('--verbose', action='store_true', help='log the status messages of the plugin too')
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser('serve', help='answer lookups until terminated')
+    command.add_argument('--mode', default='600', help='permissions of the socket, 666 to share it between users')
+    command.add_argument('--preload', nargs='*', default=[], help='languages to load before listening')
+    command.set_defaults(run=serve)
+
+    for name, run, description in [('lookup', lookup, 'print a page, through the daemon when one runs'),
+                                   ('load', load, 'time concurrent lookups against a running daemon')]:
+        command = commands.add_parser(name, help=description)
+        command.add_argument('--language', default='en')
+        command.add_argument('--fallback', default=False)
+        command.set_defaults(run=run)
+    command.add_argument('--clients', type=int, default=8)
+    command.add_argument('--requests', type=int, default=500)
+    command.add_argument('--op', choices=['popup', 'panel'], default='popup')
+    command.add_argument('--seed', type=int, default=1)
+    commands.choices['lookup'].add_argument('symbol')
+    commands.choices['lookup'].add_argument('--popup', action='store_true', help='print the popup html instead of text')
+
+    command = commands.add_parser('prebuild', help='render every page into the prebuilt cache')
+    command.add_argument('--languages', nargs='*', help='defaults to every pack in the cache directory')
+    command.add_argument('--processes', type=int, help='defaults to the number of cores')
+    command.set_defaults(run=prebuild)
+
+    args = parser.parse_args()
+    if not getattr(args, 'run', None):
+        parser.error('a command is required')
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
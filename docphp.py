@@ -1,14 +1,31 @@
 import sublime
 import sublime_plugin
 import re
+import hashlib
+import math
+import heapq
+import array
+import mmap
+import struct
+import zlib
 import os
 import shutil
 import tarfile
 import webbrowser
+import zipfile
 import time
-import urllib
+import sys
+import threading
+import queue
+import urllib.request
+import urllib.error
+import http.client
+import socket
+import gzip
+import concurrent.futures
 from Default import symbol as sublime_symbol
 from html.parser import HTMLParser
+from collections import OrderedDict, deque
 
 package_name = 'DocPHPManualer'
 setting_file = package_name + '.sublime-settings'
@@ -17,10 +34,56 @@ docphp_languages = {}
 currentView = False
 currentSettings = None
 openfiles = {}
-entities = {
-    "iso": False,
-    "html": False
-}
+renderCache = {"size": None}
+# Name of every render in the prebuilt cache to the zip holding it, read
+# in the background as it opens every zip
+prebuiltIndex = None
+prebuiltLoads = {"generation": 0, "loading": False}
+prebuildBatchSize = 256
+languageSwitches = {}
+searchIndexes = {}
+searchWordPattern = re.compile('[a-z][a-z0-9]+')
+searchStopWords = frozenset([
+    'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'for', 'from', 'has', 'if', 'in', 'into', 'is', 'it',
+    'its', 'not', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'when', 'which', 'will', 'with',
+])
+storeLock = threading.RLock()
+# Builds of one process take turns in writing the shared page store
+sharedStoreLock = threading.Lock()
+entities = {}
+entityPattern = re.compile('&[a-zA-Z0-9]+;')
+pagePattern = re.compile('<br>|&#039;|&\\$|&[a-zA-Z0-9]+;')
+# Runs of whitespace and tags are what the panel rewrites, the text between
+# them is only scanned for HTML entities
+panelPattern = re.compile('(?:\\s|<[^>]*>)+|&[a-zA-Z0-9]+;')
+panelRuns = {}
+panelSplitPattern = re.compile('>[^\\s<&]')
+panelChunkSize = 16384
+constantAnchorPattern = re.compile(b'id="(?:constant\\.([a-z0-9_-]+)|([a-z0-9_-]+)\\.constants\\.([a-z0-9_-]+))"', re.I)
+# Pages a popup links to, the first ones are rendered ahead of a click
+popupLinkPattern = re.compile('href="([^":/#]+)\\.html[#"]')
+# Seconds to wait for the daemon, a language it loads cold takes a while
+daemonTimeout = 30
+popupStyle = None
+popupStyleHash = None
+# Popups over this many characters crash Sublime Text
+popupSizeLimit = 65535
+# Rendered sections come out about this much larger than in the page
+popupSizeRatio = 0.75
+# Goes up whenever pages render differently, renders cached before are not used
+renderVersion = 2
+blockPattern = re.compile('<(/?)(div|ul|ol|dl|li|dt|dd|table)\\b[^>]*>')
+languageLoads = {}
+resolutionTables = {}
+languageLoadLock = threading.Lock()
+# A refresh replaces the pack and its stores, one at a time
+refreshLock = threading.Lock()
+mainThread = None
+startupTimes = {}
+# (stage, seconds, symbol) of the latest lookups, filled when performance_stats is on
+stageTimings = deque(maxlen=4096)
+statCounters = {}
+stages = ['symbol at point', 'resolve', 'extract', 'decode', 'render', 'render panel', 'show', 'lookup']
 
 language = ''
 
@@ -28,10 +91,22 @@ downloading = False
 
 
 def plugin_loaded():
-    global currentSettings, language, currentView
+    global currentSettings, language, currentView, mainThread
+    begin = time.time()
     currentSettings = sublime.load_settings(setting_file)
     language = currentSettings.get('language')
     currentView = sublime.active_window().active_view()
+    mainThread = threading.current_thread()
+
+    # Everything else happens off the main thread, commands issued before
+    # the languages are loaded wait for them or show that they are loading
+    sublime.set_timeout_async(startUp, 0)
+    startupTimes["plugin_loaded"] = time.time() - begin
+
+
+def startUp():
+    begin = time.time()
+    loadEntities()
 
     docphpPath = getDocphpPath()
     if not os.path.isdir(docphpPath + 'language'):
@@ -40,13 +115,26 @@ def plugin_loaded():
     if not callable(sublime_symbol.symbol_at_point) or not callable(sublime_symbol.navigate_to_symbol):
         sublime.error_message('Cannot find symbol_at_point from Default.sublime-package\n\nPlease restore the file which usually replaced by outdated localizations')
 
+    # A running daemon holds the languages for every instance
+    if language and not daemonAvailable():
+        loadLanguageAsync(language, True)
+        if getSetting('language_fallback') and getSetting('language_fallback') != language:
+            loadLanguageAsync(getSetting('language_fallback'), True)
+
+    sublime.set_timeout_async(refreshLanguagesInBackground, 60000)
+    loadPrebuiltIndexInBackground()
+
     from package_control import events
 
     if events.install(package_name) or not language:
-        currentView.run_command('docphp_checkout_language', {"is_init": True, "set_fallback": True})
+        sublime.set_timeout(lambda: currentView.run_command('docphp_checkout_language', {"is_init": True, "set_fallback": True}), 0)
+    startupTimes["start_up"] = time.time() - begin
 
 
 def plugin_unloaded():
+    prefetcher.stop()
+    for languageName in list(searchIndexes.keys()):
+        unloadSearchIndex(languageName)
     for k in openfiles:
         try:
             openfiles[k].close()
@@ -71,6 +159,50 @@ def setSetting(key, value):
     sublime.save_settings(setting_file)
 
 
+def stageClock():
+    # None when the stats are off, which recordStage takes as a no-op
+    if getSetting('performance_stats'):
+        return time.perf_counter()
+    return None
+
+
+def recordStage(stage, begin, symbol=None):
+    if begin is not None:
+        stageTimings.append((stage, time.perf_counter() - begin, symbol))
+
+
+def countStat(name):
+    if getSetting('performance_stats'):
+        statCounters[name] = statCounters.get(name, 0) + 1
+
+
+def getPerformanceReport():
+    byStage = {}
+    for stage, seconds, symbol in list(stageTimings):
+        byStage.setdefault(stage, []).append(seconds)
+
+    lines = ['%-16s %7s %9s %9s %9s' % ('stage', 'count', 'p50 ms', 'p95 ms', 'max ms')]
+    for stage in stages:
+        if stage not in byStage:
+            continue
+        samples = sorted(byStage[stage])
+        lines.append('%-16s %7d %9.2f %9.2f %9.2f' % (
+            stage, len(samples), samples[len(samples) // 2] * 1000,
+            samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, samples[-1] * 1000))
+
+    lines.append('')
+    for name in sorted(statCounters):
+        lines.append('%-24s %d' % (name, statCounters[name]))
+
+    slowest = sorted((record for record in stageTimings if record[0] == 'lookup'), key=lambda record: -record[1])
+    if slowest:
+        lines.append('')
+        lines.append('slowest lookups')
+        for stage, seconds, symbol in slowest[:10]:
+            lines.append('%9.2f ms  %s' % (seconds * 1000, symbol))
+    return '\n'.join(lines)
+
+
 def getAllLanguages():
     return sublime.decode_value(sublime.load_resource('Packages/' + package_name + '/languages.json'))
 
@@ -106,41 +238,74 @@ def getLanguageList(languageName=None, format='all', getAll=True):
     return languageList, index
 
 
+def getLanguageSwitch():
+    installed = getSetting('languages')
+    key = None if installed is None else tuple(sorted(installed))
+    if key not in languageSwitches:
+        switch = ''
+        languages, _ = getLanguageList(format='raw', getAll=False)
+        if len(languages) > 1:
+            switch += '&nbsp;&nbsp;&nbsp;&nbsp;Change language:'
+            for lang in languages:
+                switch += ' <a href="changeto.' + lang['shortName'] + '">' + lang['nativeName'] + '</a>'
+        languageSwitches[key] = switch
+    return languageSwitches[key]
+
+
+def loadEntities():
+    resourceMap = {
+        "iso": "IsoEntities.json",
+        "html": "HtmlEntities.json",
+    }
+    for category in resourceMap:
+        forward = sublime.decode_value(sublime.load_resource('Packages/' + package_name + '/' + resourceMap[category]))
+
+        table = {}
+        for name, code in forward.items():
+            table['&%d;' % code] = name
+        for name, code in forward.items():
+            table['&' + name + ';'] = chr(code)
+        entities[category] = table
+
+    # Raw pages get these few fixes and their ISO entities decoded in one go
+    page = dict(entities['iso'])
+    page.update({
+        '&mdash;': chr(8212),
+        '&quot;': '"',
+        '<br>': '',
+        '&#039;': "'",
+        '&$': "&amp;$",
+        '&raquo;': chr(187),
+    })
+    entities['page'] = page
+
+
+def getEntityTable(category):
+    if category not in entities:
+        loadEntities()
+    return entities[category]
+
+
 def decodeEntity(xml, category='iso'):
-    global entities
     if not isinstance(xml, str):
         return xml
-    if entities[category]:
-        forward, reverse = entities[category]
-    else:
-        resourceMap = {
-            "iso": "IsoEntities.json",
-            "html": "HtmlEntities.json",
-        }
-        forward = sublime.decode_value(sublime.load_resource('Packages/' + package_name + '/' + resourceMap[category]))
+    table = getEntityTable(category)
+    return entityPattern.sub(lambda m: table.get(m.group(0), m.group(0)), xml)
 
-        reverse = dict((v, k) for k, v in forward.items())
-        entities[category] = (forward, reverse)
 
-    def parseEntity(match):
-        entity = match.group(1)
-        try:
-            if entity.isdigit():
-                return reverse[int(entity)]
-            else:
-                return chr(forward[entity])
-        except:
-            return match.group(0)
-    xml = re.sub('&([a-zA-Z0-9]+);', parseEntity, xml)
-    return xml
+def transformPage(page):
+    table = getEntityTable('page')
+    return pagePattern.sub(lambda m: table.get(m.group(0), m.group(0)), page)
 
 
 def getDocphpPath():
     return sublime.cache_path() + '/' + package_name + '/'
 
 
-def getTarGzPath():
-    return getDocphpPath() + 'language/php_manual_' + language + '.tar.gz'
+def getTarGzPath(languageName=None):
+    if not languageName:
+        languageName = language
+    return getDocphpPath() + 'language/php_manual_' + languageName + '.tar.gz'
 
 
 def getI18nCachePath(languageName=None):
@@ -149,59 +314,793 @@ def getI18nCachePath(languageName=None):
     return getDocphpPath() + 'language/' + languageName + '/'
 
 
-def getTarHandler():
-    tarGzPath = getTarGzPath()
+def getPageStorePath(languageName=None):
+    return getI18nCachePath(languageName) + 'pages.zip'
+
+
+def getPageStore(languageName=None):
+    storePath = getPageStorePath(languageName)
+
+    try:
+        store = openfiles[storePath]
+    except KeyError:
+        if not os.path.isfile(storePath):
+            buildPageStore(languageName)
+        # Not while a refresh holds the lock to replace the store
+        with storeLock:
+            store = openfiles.get(storePath) or zipfile.ZipFile(storePath)
+            openfiles[storePath] = store
+    return store
+
+
+def getSharedStorePath():
+    return getDocphpPath() + 'language/shared/pages.zip'
+
+
+def getSharedStore():
+    storePath = getSharedStorePath()
 
     try:
-        tar = openfiles[tarGzPath]
+        store = openfiles[storePath]
     except KeyError:
-        tar = tarfile.open(tarGzPath)
-        openfiles[tarGzPath] = tar
-    return tar
+        store = zipfile.ZipFile(storePath)
+        openfiles[storePath] = store
+    return store
+
+
+def closeSharedStore():
+    with storeLock:
+        store = openfiles.pop(getSharedStorePath(), None)
+        if store:
+            store.close()
+
+
+def buildPageStore(languageName=None, tarGzPath=None, storePath=None, fileobj=None, visit=None):
+    # The tarball is a single gzip stream, so reading a member near the end
+    # means inflating everything before it. Repack the pages once into a zip,
+    # whose central directory gives every page its own offset.
+    #
+    # Translations leave many pages as they are in English, so the pages
+    # themselves go to a store shared by all languages under the md5 of
+    # their content. The language's own store has an empty member per page
+    # whose comment is that md5 along with the size and crc of the page.
+    #
+    # fileobj streams the inflated tarball instead, and visit is called
+    # with every page to build more indexes in the same pass.
+    if not languageName:
+        languageName = language
+    if not tarGzPath:
+        tarGzPath = getTarGzPath(languageName)
+    if not storePath:
+        storePath = getPageStorePath(languageName)
+    tmpPath = storePath + '.building'
+
+    dirname = os.path.dirname(storePath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    sharedPath = getSharedStorePath()
+    if not os.path.isdir(os.path.dirname(sharedPath)):
+        os.makedirs(os.path.dirname(sharedPath))
+    sharedTmpPath = sharedPath + '.%d.building' % os.getpid()
+
+    sublime.status_message(package_name + ': indexing ' + languageName)
+    with sharedStoreLock:
+        # Pages are added to a copy, a build that fails halfway leaves the
+        # store as it was
+        if os.path.isfile(sharedPath):
+            shutil.copyfile(sharedPath, sharedTmpPath)
+        added = 0
+        try:
+            with tarfile.open(tarGzPath, 'r|' if fileobj else 'r|gz', fileobj) as tar, \
+                    zipfile.ZipFile(tmpPath, 'w', zipfile.ZIP_DEFLATED) as store, \
+                    zipfile.ZipFile(sharedTmpPath, 'a', zipfile.ZIP_DEFLATED) as shared:
+                names = set(shared.namelist())
+                for tarinfo in tar:
+                    m = re.search('^php-chunked-xhtml/(.*)\\.html$', tarinfo.name)
+                    if not tarinfo.isfile() or not m:
+                        continue
+                    data = tar.extractfile(tarinfo).read()
+                    digest = hashlib.md5(data).hexdigest()
+                    if digest + '.html' not in names:
+                        shared.writestr(digest + '.html', data)
+                        names.add(digest + '.html')
+                        added += 1
+                    info = zipfile.ZipInfo(tarinfo.name)
+                    info.comment = ('%s %d %d' % (digest, len(data), zlib.crc32(data) & 0xffffffff)).encode()
+                    store.writestr(info, b'')
+                    if visit:
+                        visit(m.group(1), data)
+        except:
+            for path in [tmpPath, sharedTmpPath]:
+                if os.path.isfile(path):
+                    os.unlink(path)
+            raise
+        with storeLock:
+            closeSharedStore()
+            os.replace(sharedTmpPath, sharedPath)
+            os.replace(tmpPath, storePath)
+    if getSetting('debug'):
+        print(package_name + ' %s indexed, %d pages added to the shared store' % (languageName, added))
+    sublime.status_message(package_name + ': ' + languageName + ' indexed')
+
+    if storePath == getPageStorePath(languageName):
+        compactSharedStore()
+
+
+def compactSharedStore():
+    # Pages of replaced packs stay in the shared store until they are a
+    # quarter of it, then it is rewritten with the pages still in use
+    languagePath = getDocphpPath() + 'language/'
+    sharedPath = getSharedStorePath()
+    if not os.path.isfile(sharedPath):
+        return
+    with sharedStoreLock:
+        used = set()
+        for name in os.listdir(languagePath):
+            # A refresh in progress has its new store next to the old one,
+            # a checkout next to its download
+            storePaths = [getPageStorePath(name), getPageStorePath(name) + '.new']
+            if name.endswith('.pages.zip'):
+                storePaths.append(languagePath + name)
+            for storePath in storePaths:
+                if not os.path.isfile(storePath):
+                    continue
+                with zipfile.ZipFile(storePath) as store:
+                    for info in store.infolist():
+                        if info.comment:
+                            used.add(info.comment.split()[0].decode() + '.html')
+
+        with storeLock:
+            names = getSharedStore().namelist()
+        unused = len(names) - len(used.intersection(names))
+        if unused * 4 <= len(names):
+            return
+
+        tmpPath = sharedPath + '.%d.compacting' % os.getpid()
+        with zipfile.ZipFile(tmpPath, 'w', zipfile.ZIP_DEFLATED) as compacted:
+            for name in names:
+                if name in used:
+                    with storeLock:
+                        data = getSharedStore().read(name)
+                    compacted.writestr(name, data)
+        with storeLock:
+            closeSharedStore()
+            try:
+                os.replace(tmpPath, sharedPath)
+            except OSError as e:
+                # Windows does not replace files other instances have open
+                os.unlink(tmpPath)
+                if getSetting('debug'):
+                    print(package_name + ' compacting the shared store failed: ' + str(e))
+                return
+    if getSetting('debug'):
+        print(package_name + ' dropped %d unused pages from the shared store' % unused)
+
+
+def getStoreEntries(store):
+    # (symbol, size, crc) of every page in a language's store
+    entries = []
+    for info in store.infolist():
+        m = re.search('^php-chunked-xhtml/(.*)\.html$', info.filename)
+        if not m:
+            continue
+        if info.comment:
+            digest, size, crc = info.comment.decode().split()
+            entries.append((m.group(1), int(size), int(crc)))
+        else:
+            entries.append((m.group(1), info.file_size, info.CRC))
+    return entries
+
+
+def getPageDigest(languageName, symbol):
+    store = getPageStore(languageName)
+    with storeLock:
+        info = store.getinfo('php-chunked-xhtml/' + symbol + '.html')
+    return info.comment.split()[0] if info.comment else None
+
+
+def readPage(languageName, symbol):
+    # Outside of storeLock, building the store takes sharedStoreLock
+    store = getPageStore(languageName)
+    with storeLock:
+        info = store.getinfo('php-chunked-xhtml/' + symbol + '.html')
+        # Stores built by older versions hold the pages themselves
+        if not info.comment:
+            return store.read(info)
+        name = info.comment.split()[0].decode() + '.html'
+        try:
+            return getSharedStore().read(name)
+        except (KeyError, OSError, IOError):
+            pass
+
+    # Another instance replaced the shared store since it was opened, or
+    # compacted it while this language was being built, which lost pages
+    closeSharedStore()
+    with storeLock:
+        try:
+            return getSharedStore().read(name)
+        except (KeyError, OSError, IOError):
+            pass
+    repairPath = getPageStorePath(languageName) + '.repair'
+    buildPageStore(languageName, None, repairPath)
+    os.unlink(repairPath)
+    with storeLock:
+        return getSharedStore().read(name)
+
+
+def detachLanguageFiles(languageName):
+    # Takes the open files of a language out of openfiles without closing
+    # them, for whoever still reads them
+    with storeLock:
+        paths = [getTarGzPath(languageName), getPageStorePath(languageName), getSymbolIndexPath(languageName)]
+        return [openfiles.pop(path) for path in paths if path in openfiles]
+
 
+def closeFiles(files):
+    for f in files:
+        try:
+            f.close()
+        except Exception as e:
+            if getSetting('debug'):
+                print(e)
+
+
+def closeLanguageFiles(languageName):
+    closeFiles(detachLanguageFiles(languageName))
+
+
+def replaceLanguageFiles(languageName, tarGzPath, storePath, anchors, pages=None):
+    # Moves a new pack and its store in place and swaps their indexes into
+    # a loaded language, dropping the cached definitions of pages, or of
+    # every page when pages is None. The old files are closed only after
+    # that, lookups that started on the old index can still finish.
+    with storeLock:
+        stale = detachLanguageFiles(languageName)
+        if os.name == 'nt':
+            # Windows does not replace files that are open
+            closeFiles(stale)
+            stale = []
+        if pages is None and os.path.isdir(getI18nCachePath(languageName)):
+            shutil.rmtree(getI18nCachePath(languageName))
+        if not os.path.isdir(getI18nCachePath(languageName)):
+            os.makedirs(getI18nCachePath(languageName))
+        os.replace(tarGzPath, getTarGzPath(languageName))
+        os.replace(storePath, getPageStorePath(languageName))
+        symbols = getSymbolIndex(languageName)
+        aliases = getAliasIndex(languageName, anchors)
+
+        if languageName in docphp_languages:
+            loaded = docphp_languages[languageName]
+            if pages is None:
+                loaded["definition"] = DefinitionCache(getDefinitionCacheSize(languageName))
+                loaded["panels"] = DefinitionCache(getDefinitionCacheSize(languageName) // 4)
+            else:
+                for symbol in pages:
+                    loaded["definition"].discard(symbol)
+                    loaded["panels"].discard(symbol)
+            loaded.update({"symbolList": symbols, "aliases": aliases})
+            loaded.pop("searchPanel", None)
+    closeFiles(stale)
 
-def loadLanguage():
+
+def loadLanguage(languageName=None):
     global docphp_languages
-    tarGzPath = getTarGzPath()
+    if not languageName:
+        languageName = language
+    tarGzPath = getTarGzPath(languageName)
 
     if not os.path.isfile(tarGzPath):
         return False
 
-    tar = getTarHandler()
-    tar.getmembers()
+    symbols = getSymbolIndex(languageName)
+    aliases = getAliasIndex(languageName)
+    docphp_languages[languageName] = {
+        "symbolList": symbols,
+        "aliases": aliases,
+        "definition": DefinitionCache(getDefinitionCacheSize(languageName)),
+        "panels": DefinitionCache(getDefinitionCacheSize(languageName) // 4),
+        "used": time.time(),
+    }
 
-    def generate():
-        symbols = {}
+    if getSetting('search_index'):
+        getSearchIndex(languageName).startBuilding()
 
-        for tarinfo in tar:
-            m = re.search('^php-chunked-xhtml/(.*)\.html$', tarinfo.name)
-            if m:
-                symbols[m.group(1)] = m.group(0)
-        return symbols
+    return True
 
-    symbols = getJsonOrGenerate('packed_symbols', generate)
-    docphp_languages[language] = {"symbolList": symbols, "definition": {}}
 
-    return True
+def loadLanguageAsync(languageName, retry=False):
+    # One load per language, whoever asks first starts it and everyone else
+    # gets the same future. A failed load is only started again on retry,
+    # so that waiting on it reports the failure.
+    with languageLoadLock:
+        future = languageLoads.get(languageName)
+        if future and not (retry and future.done() and (future.exception() or not future.result())):
+            return future
+        future = concurrent.futures.Future()
+        languageLoads[languageName] = future
+
+    def load():
+        begin = time.time()
+        try:
+            future.set_result(loadLanguage(languageName))
+        except Exception as e:
+            future.set_exception(e)
+        startupTimes[languageName] = time.time() - begin
+        if getSetting('debug'):
+            print(package_name + ' loaded %s in %.3fs' % (languageName, startupTimes[languageName]))
 
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+    return future
 
-def getJsonOrGenerate(name, callback):
-    filename = getI18nCachePath() + name + '.json'
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf8') as f:
-            json = f.read(10485760)
-        content = sublime.decode_value(json)
 
-    else:
-        content = callback()
+def waitForLanguage(languageName):
+    if languageName in docphp_languages:
+        return True
+    if not os.path.isfile(getTarGzPath(languageName)):
+        return False
+    future = loadLanguageAsync(languageName)
+    # Never block the main thread on a pack that is still being indexed
+    if threading.current_thread() is mainThread and not future.done():
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        if getSetting('debug'):
+            print(package_name + ' loading ' + languageName + ' failed: ' + str(e))
+        return False
+
+
+def getPageStoreFingerprint(languageName=None):
+    # The size and the central directory at the end of the zip, rather than
+    # the mtime, so that caches copied to another machine stay valid
+    storePath = getPageStorePath(languageName)
+    size = os.path.getsize(storePath)
+    with open(storePath, 'rb') as f:
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+    return hashlib.md5(str(size).encode() + tail).digest()
+
+
+def getSymbolIndexPath(languageName=None):
+    return getI18nCachePath(languageName) + 'symbols.idx'
+
+
+def getSymbolIndex(languageName=None):
+    indexPath = getSymbolIndexPath(languageName)
+    if indexPath in openfiles:
+        return openfiles[indexPath]
+
+    # Packs checked out by older versions only have the tarball, the store
+    # is built here on first load
+    store = getPageStore(languageName)
+    fingerprint = getPageStoreFingerprint(languageName)
+
+    try:
+        symbols = SymbolIndex(indexPath, fingerprint)
+    except (OSError, IOError, ValueError) as e:
+        if getSetting('debug'):
+            print(package_name + ' rebuilding symbol index: ' + str(e))
+        with storeLock:
+            entries = getStoreEntries(store)
+        SymbolIndex.build(indexPath, fingerprint, entries)
+        symbols = SymbolIndex(indexPath, fingerprint)
+
+    # Superseded by the symbol index
+    legacyPath = getI18nCachePath(languageName) + 'packed_symbols.json'
+    if os.path.isfile(legacyPath):
+        os.unlink(legacyPath)
+    # Superseded by the render cache shared by all languages
+    if os.path.isdir(getI18nCachePath(languageName) + 'rendered'):
+        shutil.rmtree(getI18nCachePath(languageName) + 'rendered', True)
+
+    openfiles[indexPath] = symbols
+    return symbols
+
+
+def getAliasIndexPath(languageName=None):
+    return getI18nCachePath(languageName) + 'aliases.json'
+
+
+def getPageAnchors(page):
+    # Constants documented by a page, as the ids of their anchors
+    anchors = []
+    for m in constantAnchorPattern.finditer(page):
+        if m.group(1):
+            alias = m.group(1).decode()
+        else:
+            alias = (m.group(2) + b'.' + m.group(3)).decode()
+        anchors.append(alias.lower().replace('_', '-'))
+    return anchors
+
+
+def getAliasIndex(languageName=None, anchors=None):
+    # Names that are not page ids of their own: constants, which live in
+    # anchors of the pages documenting them, and method names that only
+    # one class of the manual has, for calls on objects of unknown class.
+    # anchors has the anchors of every page when they are known already.
+    if not languageName:
+        languageName = language
+    symbols = getSymbolIndex(languageName)
+    aliasPath = getAliasIndexPath(languageName)
+    fingerprint = hashlib.md5(getPageStoreFingerprint(languageName)).hexdigest()
+    try:
+        with open(aliasPath, 'r', encoding='utf8') as f:
+            cached = sublime.decode_value(f.read())
+        if cached["fingerprint"] == fingerprint:
+            return cached["aliases"]
+    except (OSError, IOError, ValueError, KeyError):
+        pass
+
+    keys = symbols.keys()
+    aliases = {}
+    methods = {}
+    for key in keys:
+        m = re.search('^([^.]+)\.([^.]+)$', key)
+        if m and 'class.' + m.group(1) in symbols:
+            methods.setdefault(m.group(2), []).append(key)
+    for name, pages in methods.items():
+        if len(pages) == 1:
+            aliases['->' + name] = pages[0]
+
+    for key in keys:
+        if anchors is None:
+            pageAnchors = getPageAnchors(readPage(languageName, key))
+        else:
+            pageAnchors = anchors.get(key, [])
+        for alias in pageAnchors:
+            if alias not in aliases:
+                aliases[alias] = key
+
+    with open(aliasPath, 'w', encoding='utf8') as f:
+        f.write(sublime.encode_value({"fingerprint": fingerprint, "aliases": aliases}))
+    return aliases
+
+
+def getSearchPanel(languageName=None):
+    if not languageName:
+        languageName = language
+    loaded = docphp_languages[languageName]
+    panel = loaded.get("searchPanel")
+
+    if not panel:
+        files = sorted(key.replace('-', '_') for key in loaded["symbolList"].keys())
+        panel = {
+            "files": files,
+            "positions": dict((name, position) for position, name in enumerate(files)),
+            "items": None,
+            "summaries": -1,
+        }
+        loaded["searchPanel"] = panel
+
+    # Summaries come from the search index, which may still be building
+    index = searchIndexes.get(languageName)
+    summaries = index.segments if index else 0
+    if panel["summaries"] != summaries:
+        descriptions = index.descriptions if index else {}
+        items = []
+        for name in panel["files"]:
+            kind = name.split('.', 1)[0] if '.' in name else 'page'
+            if kind not in ['function', 'class', 'book']:
+                kind = 'page'
+            description = descriptions.get(name.replace('_', '-'))
+            items.append([name, kind + (' - ' + description if description else '')])
+        panel["items"] = items
+        panel["summaries"] = summaries
+
+    return panel
+
+
+def getDefinitionCacheSize(languageName):
+    size = getSetting('definition_cache_size')
+    if isinstance(size, dict):
+        size = size.get(languageName, size.get('default', 8))
+    return size * 1048576
+
+
+def unloadIdleLanguages():
+    idle = getSetting('language_idle_unload')
+    if not idle:
+        return
+    now = time.time()
+    for languageName in list(docphp_languages.keys()):
+        if now - docphp_languages[languageName]["used"] > idle:
+            if getSetting('debug'):
+                print(package_name + ' unloading idle language ' + languageName)
+            del docphp_languages[languageName]
+            languageLoads.pop(languageName, None)
+            for pair in list(resolutionTables.keys()):
+                if languageName in pair:
+                    del resolutionTables[pair]
+            unloadSearchIndex(languageName)
+            closeLanguageFiles(languageName)
 
+
+def getSearchIndexPath(languageName=None):
+    return getI18nCachePath(languageName) + 'search/'
+
+
+def getSearchIndex(languageName=None):
+    if not languageName:
+        languageName = language
+    if languageName not in searchIndexes:
+        searchIndexes[languageName] = SearchIndex(languageName)
+    return searchIndexes[languageName]
+
+
+def unloadSearchIndex(languageName):
+    index = searchIndexes.pop(languageName, None)
+    if index:
+        index.stopBuilding()
+
+
+def getSearchTerms(text):
+    terms = []
+    for word in searchWordPattern.findall(text.lower()):
+        if word in searchStopWords:
+            continue
+        # Just enough stemming for "pads" to find "pad"
+        if len(word) > 3 and word[-1] == 's' and word[-2] != 's':
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def getSearchDocument(symbol, page):
+    m = re.search('<h[12][^>]*>(.*?)</h[12]>', page, re.S)
+    name = re.sub('<[^>]*>', '', m.group(1)).strip() if m else symbol
+    m = re.search('<title>(.*?)</title>', page, re.S)
+    description = m.group(1).strip() if m else ''
+
+    # Leave out the navigation bars above and below the content
+    start = page.find('<hr />')
+    end = page.rfind('<hr />')
+    if start != -1 and end > start:
+        page = page[start:end]
+    body = {}
+    for term in getSearchTerms(re.sub('<[^>]*>', ' ', page)):
+        body[term] = body.get(term, 0) + 1
+
+    weights = {}
+    for term, count in sorted(body.items(), key=lambda item: -item[1])[:40]:
+        weights[term] = 1 + math.log(count)
+    for term in getSearchTerms(description):
+        weights[term] = weights.get(term, 0) + 4
+    for term in getSearchTerms(name + ' ' + symbol.replace('-', ' ')):
+        weights[term] = weights.get(term, 0) + 10
+    return name, description, weights
+
+
+def getRenderCachePath():
+    return getDocphpPath() + 'language/rendered/'
+
+
+def getRenderFingerprint(languageName=None):
+    global popupStyleHash
+    if popupStyleHash is None:
+        popupStyleHash = hashlib.md5(getPopupStyle().encode()).hexdigest()
+    # The language switcher in the header depends on the installed languages
+    return '%d-%s-%s' % (renderVersion, popupStyleHash, ','.join(sorted(getSetting('languages') or [])))
+
+
+def getRenderCacheFile(symbol, can_back, languageName=None, page=None, part=0):
+    return getRenderCachePath() + getRenderCacheName(symbol, can_back, languageName, page, part)
+
+
+def getRenderCacheName(symbol, can_back, languageName=None, page=None, part=0, extension='.html'):
+    if not languageName:
+        languageName = language
+    if page is None:
+        symbols = getSymbolIndex(languageName)
+        pageId = symbols.pageId(symbol)
+        page = symbols.page(pageId) if pageId != -1 else (0, 0)
+    # Keyed by the size and crc of the page itself rather than its language,
+    # so that a refreshed pack keeps the renders of every page that did not
+    # change and a page another language has too is rendered once
+    key = '\n'.join([symbol, str(bool(can_back)), '%d-%d' % page, getRenderFingerprint(languageName)])
+    if part:
+        key += '\n%d' % part
+    return hashlib.md5(key.encode()).hexdigest() + extension
+
+
+def getRenderedPopup(symbol, can_back, languageName=None, part=0):
+    name = getRenderCacheName(symbol, can_back, languageName, None, part)
+    if getSetting('render_cache_size'):
+        try:
+            filename = getRenderCachePath() + name
+            with open(filename, 'r', encoding='utf8') as f:
+                content = f.read()
+            # mtime is the LRU clock
+            os.utime(filename, None)
+            return content
+        except (OSError, IOError):
+            pass
+    return getPrebuilt(name)
+
+
+def getPrebuiltPath():
+    return getDocphpPath() + 'language/prebuilt/'
+
+
+def loadPrebuiltIndex():
+    global prebuiltIndex
+    generation = prebuiltLoads["generation"]
+    index = {}
+    if os.path.isdir(getPrebuiltPath()):
+        for filename in sorted(os.listdir(getPrebuiltPath())):
+            if filename.endswith('.zip'):
+                path = getPrebuiltPath() + filename
+                try:
+                    with zipfile.ZipFile(path) as batch:
+                        for member in batch.namelist():
+                            index[member] = path
+                except (OSError, IOError, zipfile.BadZipfile):
+                    pass
+    with storeLock:
+        # Batches added or removed meanwhile are read by the next load
+        if generation == prebuiltLoads["generation"]:
+            prebuiltIndex = index
+    return index
+
+
+def loadPrebuiltIndexInBackground():
+    with storeLock:
+        if prebuiltLoads["loading"]:
+            return
+        prebuiltLoads["loading"] = True
+
+    def load():
+        try:
+            loadPrebuiltIndex()
+        finally:
+            prebuiltLoads["loading"] = False
+
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+
+
+def getPrebuilt(name):
+    # Renders of the prebuilt cache, which the LRU budget does not cover
+    index = prebuiltIndex
+    if index is None:
+        # The main thread goes without them until the index is read
+        if threading.current_thread() is mainThread:
+            loadPrebuiltIndexInBackground()
+            return None
+        index = loadPrebuiltIndex()
+    path = index.get(name)
+    if not path:
+        return None
+    with storeLock:
+        try:
+            batch = openfiles.get(path)
+            if not batch:
+                batch = openfiles[path] = zipfile.ZipFile(path)
+            content = batch.read(name).decode('utf8')
+        except (OSError, IOError, KeyError, zipfile.BadZipfile):
+            return None
+    countStat('prebuilt hit')
+    return content
+
+
+def closePrebuilt():
+    global prebuiltIndex
+    with storeLock:
+        for path in set((prebuiltIndex or {}).values()):
+            if path in openfiles:
+                openfiles.pop(path).close()
+        prebuiltIndex = None
+        prebuiltLoads["generation"] += 1
+
+
+def getPrebuiltBatchPath(languageName, number):
+    # Named after the store the pages come from, a refreshed pack starts over
+    fingerprint = hashlib.md5(getPageStoreFingerprint(languageName)).hexdigest()[:8]
+    return getPrebuiltPath() + '%s-%s-%04d.zip' % (languageName, fingerprint, number)
+
+
+def getPrebuildBatches(languageName):
+    # Zips of earlier packs of the language are removed, so the batches left
+    # to build are the ones without a zip
+    prefix = os.path.basename(getPrebuiltBatchPath(languageName, 0))[:-8]
+    if os.path.isdir(getPrebuiltPath()):
+        for filename in os.listdir(getPrebuiltPath()):
+            if filename.startswith(languageName + '-') and not filename.startswith(prefix):
+                closePrebuilt()
+                os.unlink(getPrebuiltPath() + filename)
+    else:
+        os.makedirs(getPrebuiltPath())
+    count = (len(getSymbolIndex(languageName)) + prebuildBatchSize - 1) // prebuildBatchSize
+    return [number for number in range(count) if not os.path.isfile(getPrebuiltBatchPath(languageName, number))]
+
+
+def prebuildBatch(languageName, number):
+    # Renders every part of the popups with and without a back link and the
+    # panel text of a batch of pages into a zip of its own, returns the
+    # number of pages
+    symbols = getSymbolIndex(languageName).keys()[number * prebuildBatchSize:(number + 1) * prebuildBatchSize]
+    path = getPrebuiltBatchPath(languageName, number)
+    with zipfile.ZipFile(path + '.building', 'w', zipfile.ZIP_DEFLATED) as batch:
+        for symbol in symbols:
+            content = getSymbolFromHtml(symbol, languageName)
+            for can_back in [False, True]:
+                part = 0
+                while part is not None:
+                    output = renderPopup(content, symbol, can_back, languageName, part)
+                    batch.writestr(getRenderCacheName(symbol, can_back, languageName, None, part), output)
+                    m = re.search('href="more\\.(\\d+)"', output)
+                    part = int(m.group(1)) if m else None
+            text = ''.join(formatPanelChunks(content, symbol, languageName))
+            batch.writestr(getRenderCacheName(symbol, False, languageName, None, 0, '.txt'), text)
+    os.replace(path + '.building', path)
+    return len(symbols)
+
+
+def prebuildLanguage(languageName, report=None):
+    # The editor has no process pool, daemon/docphpd.py prebuild is the
+    # faster way on a build machine
+    batches = getPrebuildBatches(languageName)
+    total = len(getSymbolIndex(languageName))
+    done = total - sum(min(prebuildBatchSize, total - number * prebuildBatchSize) for number in batches)
+    begin = time.time()
+    pages = 0
+    for number in batches:
+        pages += prebuildBatch(languageName, number)
+        if report:
+            report(done + pages, total, pages / max(time.time() - begin, 0.001))
+    closePrebuilt()
+    return pages
+
+
+def putRenderedPopup(symbol, can_back, content, languageName=None, part=0):
+    if not languageName:
+        languageName = language
+    budget = getSetting('render_cache_size')
+    if not budget:
+        return
+    budget = budget * 1048576
+    try:
+        filename = getRenderCacheFile(symbol, can_back, languageName, None, part)
         dirname = os.path.dirname(filename)
         if not os.path.isdir(dirname):
             os.makedirs(dirname)
-        with open(filename, 'w', encoding="utf8") as f:
-            f.write(sublime.encode_value(content))
+        data = content.encode('utf8')
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(filename + '.tmp', filename)
 
-    return content
+        if renderCache["size"] is None:
+            renderCache["size"] = sum(os.path.getsize(dirname + '/' + name) for name in os.listdir(dirname))
+        else:
+            renderCache["size"] += len(data)
+        if renderCache["size"] > budget:
+            evictRenderedPopups(budget)
+    except (OSError, IOError) as e:
+        if getSetting('debug'):
+            print(e)
+
+
+def evictRenderedPopups(budget):
+    cache = renderCache
+    dirname = getRenderCachePath()
+    entries = []
+    for name in os.listdir(dirname):
+        stat = os.stat(dirname + name)
+        entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+    cache["size"] = sum(entry[1] for entry in entries)
+    # Leave some headroom so that every new page does not trigger a scan
+    target = budget * 0.8
+    for mtime, size, name in entries:
+        if cache["size"] <= target:
+            break
+        try:
+            os.unlink(dirname + name)
+            cache["size"] -= size
+        except OSError:
+            pass
 
 
 def languageExists(languageName=None, fallback=False):
@@ -210,7 +1109,11 @@ def languageExists(languageName=None, fallback=False):
     if not language:
         currentView.run_command('docphp_checkout_language', {"is_init": True, "set_fallback": True})
         return False
-    if languageName not in docphp_languages and not loadLanguage():
+    loaded = waitForLanguage(languageName)
+    if loaded is None:
+        sublime.status_message(package_name + ': loading ' + languageName + ' manual...')
+        return False
+    if not loaded:
         if fallback:
             begin = 'The fallback'
         else:
@@ -224,65 +1127,1318 @@ def languageExists(languageName=None, fallback=False):
 
 
 def getSymbolDescription(symbol, use_language=False, fallback=False):
-    if not use_language:
-        global language
-    else:
+    global language
+    if use_language:
         language = use_language
 
+    unloadIdleLanguages()
+
     if not languageExists(language, fallback):
         return None, False
+    docphp_languages[language]["used"] = time.time()
+
+    fallbackName = None if fallback else getSetting('language_fallback')
+    if fallbackName == language:
+        fallbackName = None
+    fallbackLoaded = fallbackName and waitForLanguage(fallbackName)
+
+    begin = stageClock()
+    if fallback:
+        resolved = resolveSymbol(symbol, docphp_languages[language]["symbolList"], False)
+        resolved = resolved and (language, resolved)
+    else:
+        resolved = resolveIdentifier(symbol, language, fallbackName if fallbackLoaded else None)
+    recordStage('resolve', begin, symbol)
+
+    if not resolved:
+        countStat('resolve miss')
+        if fallbackName and not fallbackLoaded:
+            # Tells that the fallback is missing or still loading
+            languageExists(fallbackName, True)
+        return None, None
+    # Links in a fallback page lead to more pages of the fallback
+    language, symbol = resolved
+    docphp_languages[language]["used"] = time.time()
+
+    definitions = docphp_languages[language]["definition"]
+    output = definitions.get(symbol)
+    if output is None:
+        countStat('definition miss')
+        output = getSymbolFromHtml(symbol)
+
+        definitions.put(symbol, output)
+    else:
+        countStat('definition hit')
+    if getSetting('debug'):
+        print(package_name + ' ' + language + ' definitions: ' + definitions.stats())
+    return symbol, output
+
+
+def getSymbolFromHtml(symbol, languageName=None):
+    if not languageName:
+        languageName = language
+
+    # A page another language has too may be decoded already
+    digest = getPageDigest(languageName, symbol)
+    if digest:
+        for other, loaded in list(docphp_languages.items()):
+            if other == languageName or symbol not in loaded["symbolList"] or getPageDigest(other, symbol) != digest:
+                continue
+            output = loaded["definition"].peek(symbol)
+            if output is not None:
+                countStat('definition shared')
+                return output
+
+    begin = stageClock()
+    output = readPage(languageName, symbol)
+    recordStage('extract', begin, symbol)
+
+    begin = stageClock()
+    output = transformPage(output.decode(errors='ignore'))
+    recordStage('decode', begin, symbol)
+    return output
+
+
+def getPopupChildren(content, start, end):
+    # (start, end) of every block directly inside content[start:end]
+    children = []
+    depth = 0
+    for tag in blockPattern.finditer(content, start, end):
+        if tag.group(0).endswith('/>'):
+            continue
+        if tag.group(1):
+            depth -= 1
+            if depth < 0:
+                break
+            if depth == 0:
+                children.append((begin, tag.end()))
+        else:
+            if depth == 0:
+                begin = tag.start()
+            depth += 1
+    return children
+
+
+def splitPopupSection(content, section, limit):
+    # A section longer than limit is split into the blocks inside it, or
+    # inside the only block in it. The first one keeps the text before them
+    # and the last one the text after them, the others carry the opening
+    # tags of the blocks they are in so that every run of sections parses
+    # on its own.
+    start, end, openers, blockStart, blockEnd, ancestors = section
+    tag = blockPattern.match(content, blockStart)
+    children = getPopupChildren(content, tag.end(), blockEnd) if end - start > limit else []
+    ancestors += tag.group(0)
+    if len(children) == 1:
+        return splitPopupSection(content, (start, end, openers) + children[0] + (ancestors,), limit)
+    if not children:
+        return [section]
+    sections = []
+    for number, (childStart, childEnd) in enumerate(children):
+        child = (start if number == 0 else childStart,
+                 end if number == len(children) - 1 else childEnd,
+                 openers if number == 0 else ancestors,
+                 childStart, childEnd, ancestors)
+        sections.extend(splitPopupSection(content, child, limit))
+    return sections
+
+
+def getPopupSections(content, symbol, limit):
+    # (start, end, opening tags) of the blocks directly inside the page's
+    # own element, which are the synopsis, parameters, examples and so on
+    # of a reference page. The lists of book and index pages are split
+    # further, down to their items.
+    m = re.search('<div\\b[^>]*\\bid="' + re.escape(symbol) + '"[^>]*>', content)
+    if not m:
+        return []
+    sections = []
+    for start, end in getPopupChildren(content, m.end(), len(content)):
+        sections.extend(splitPopupSection(content, (start, end, '', start, end, ''), limit))
+    return [section[:3] for section in sections]
+
+
+def formatPopup(content, symbol, can_back=False, languageName=None, part=0):
+    if not isinstance(content, str):
+        return
+    if not languageName:
+        languageName = language
+
+    cached = getRenderedPopup(symbol, can_back, languageName, part)
+    if cached is not None:
+        countStat('render cache hit')
+        return cached
+    countStat('render cache miss')
+
+    begin = stageClock()
+    content = renderPopup(content, symbol, can_back, languageName, part)
+    recordStage('render', begin, symbol)
+    putRenderedPopup(symbol, can_back, content, languageName, part)
+    return content
+
+
+def renderPopup(content, symbol, can_back=False, languageName=None, part=0):
+    style = '<style>' + getPopupStyle() + '</style><div id="outer"><div id="container">'
+    budget = popupSizeLimit - len(style)
+    sections = getPopupSections(content, symbol, budget * popupSizeRatio) if len(content) > budget else []
+    if len(sections) < 2:
+        parser = PopupHTMLParser(symbol, can_back)
+        try:
+            parser.feed(content)
+        except FinishError:
+            pass
+        output = parser.output
+    else:
+        # Long pages are shown a few sections at a time, only the head of the
+        # page and the sections on display get parsed
+        head = content[:sections[0][0]]
+        head = len(head) - head.find('id="' + symbol + '"')
+        part = min(part, len(sections) - 1)
+        end = part + 1
+        while end < len(sections) and head + sections[end][1] - sections[part][0] < budget * popupSizeRatio:
+            end += 1
+        while True:
+            output = renderPopupSections(content, symbol, languageName, can_back, sections, part, end)
+            if len(output) < budget or end == part + 1:
+                break
+            end -= 1
+    return style + output + "</div></div>"
+
+
+def renderPopupSections(content, symbol, languageName, can_back, sections, part, end):
+    parser = PopupHTMLParser(symbol, can_back)
+    try:
+        parser.feed(content[:sections[0][0]])
+        parser.feed(sections[part][2])
+        if end == len(sections):
+            parser.feed(content[sections[part][0]:])
+        else:
+            parser.feed(content[sections[part][0]:sections[end - 1][1]])
+            parser.close_tags()
+    except FinishError:
+        pass
+    output = parser.output
+    if end < len(sections):
+        m = re.search('<h[1-6][^>]*>(.*?)</h[1-6]>|<a\\b[^>]*>(.*?)</a>', content[sections[end][0]:sections[end][1]], re.S)
+        title = re.sub('<[^>]*>|\\s+', ' ', m.group(1) or m.group(2)).strip() if m else 'more'
+        output += '<div class="more"><a href="more.%d">%s &raquo;</a> (%d of %d sections shown)</div>' % (
+            end, title, end, len(sections))
+    return output
+
+
+def renderSymbol(symbol, can_back=False, part=0, panel=False):
+    # Returns (language, symbol, popup or panel text, found) where found is
+    # None for a missing page and False for a missing language, the daemon
+    # answers its requests with this too
+    symbol, content = getSymbolDescription(symbol)
+    if not content:
+        return language, symbol, None, content
+    if panel:
+        return language, symbol, ''.join(formatPanelChunks(content, symbol, language)), True
+    return language, symbol, formatPopup(content, symbol, can_back, language, part), True
+
+
+def getDaemonSocketPath():
+    path = getSetting('daemon_socket')
+    if path is False or not hasattr(socket, 'AF_UNIX'):
+        return None
+    return path or getDocphpPath() + 'docphpd.sock'
+
+
+def daemonAvailable():
+    path = getDaemonSocketPath()
+    return bool(path) and os.path.exists(path)
+
+
+def daemonRequest(request):
+    # None when no daemon answers, the caller then does the work in process
+    if not daemonAvailable():
+        return None
+    request.update({
+        "language": language,
+        "fallback": getSetting('language_fallback'),
+        "languages": sorted(getSetting('languages') or []),
+    })
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.settimeout(daemonTimeout)
+            client.connect(getDaemonSocketPath())
+            client.sendall((sublime.encode_value(request) + '\n').encode('utf8'))
+            data = []
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                data.append(chunk)
+                if chunk.endswith(b'\n'):
+                    break
+        finally:
+            client.close()
+        response = sublime.decode_value(b''.join(data).decode('utf8'))
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+    except (OSError, IOError, ValueError) as e:
+        if getSetting('debug'):
+            print(package_name + ' daemon request failed: ' + str(e))
+        return None
+
+
+def getCachedPopup(symbol, can_back=False, part=0):
+    # Answers only from the render cache, which is cheap enough for the main
+    # thread, and follows getSymbolDescription in switching to the fallback
+    global language
+    if language not in docphp_languages:
+        return None
+    fallbackName = getSetting('language_fallback')
+    if fallbackName == language or fallbackName not in docphp_languages:
+        fallbackName = None
+    resolved = resolveIdentifier(symbol, language, fallbackName)
+    if not resolved:
+        return None
+    output = getRenderedPopup(resolved[1], can_back, resolved[0], part)
+    if output is None:
+        return None
+    countStat('render cache hit')
+    language = resolved[0]
+    docphp_languages[language]["used"] = time.time()
+    return resolved[1], output
+
+
+def getPopupStyle():
+    global popupStyle
+    if popupStyle is None:
+        popupStyle = sublime.load_resource('Packages/' + package_name + '/style.css')
+    return popupStyle
+
+
+def formatPanelRun(run):
+    output = re.sub('\s+', ' ', run)
+    output = re.sub('<(br\s*/?|/p|/div|/li|(div|p)\s[^<>]*|(div|p))>', '\n', output)
+    output = re.sub('<.*?>', '', output)
+    output = re.sub('\s+\n\s*\n\s+', '\n\n', output)
+    # The same few runs of markup repeat all over the manual
+    if len(panelRuns) < 4096:
+        panelRuns[run] = output
+    return output
+
+
+def formatPanel(content, lstrip=True):
+    if not isinstance(content, str):
+        return
+    table = getEntityTable('html')
+
+    runs = panelRuns
+
+    def replace(match):
+        token = match.group(0)
+        if token[0] == '&':
+            return table.get(token, token)
+        try:
+            return runs[token]
+        except KeyError:
+            return formatPanelRun(token)
+    output = panelPattern.sub(replace, content)
+    if lstrip and (content[:1] == '<' or content[:1].isspace()):
+        output = output.lstrip()
+    return output
+
 
+def formatPanelChunks(content, symbol, languageName=None):
+    # Plain text of the page's own element for the output panel, rendered
+    # and yielded a piece at a time so a long page shows up right away
+    if not languageName:
+        languageName = language
+    panels = docphp_languages[languageName]["panels"]
+    text = panels.get(symbol)
+    if text is None:
+        text = getPrebuilt(getRenderCacheName(symbol, False, languageName, None, 0, '.txt'))
+        if text is not None:
+            panels.put(symbol, text)
+    if text is not None:
+        countStat('panel cache hit')
+        for begin in range(0, len(text), panelChunkSize):
+            yield text[begin:begin + panelChunkSize]
+        return
+    countStat('panel cache miss')
+
+    m = re.search('<div\\b[^>]*\\bid="' + re.escape(symbol) + '"', content)
+    start = m.start() if m else 0
+    end = content.rfind('<hr />')
+    if end <= start:
+        end = len(content)
+    pieces = []
+    while start < end:
+        # Split right after a tag that text follows, where neither a run of
+        # markup nor an entity can be cut in two
+        split = panelSplitPattern.search(content, min(start + panelChunkSize, end), end)
+        split = split.start() + 1 if split else end
+        piece = formatPanel(content[start:split], not pieces)
+        pieces.append(piece)
+        yield piece
+        start = split
+    panels.put(symbol, ''.join(pieces))
+
+
+def resolveSymbol(symbol, symbolList, usePrefix=True):
     symbol = symbol.lower()
-    symbolList = docphp_languages[language]["symbolList"]
 
-    if not fallback:
+    if usePrefix:
         for prefix in ['function.', 'book.', 'class.']:
             if prefix + symbol in symbolList:
-                symbol = prefix + symbol
-                break
+                return prefix + symbol
+
+    if symbol in symbolList:
+        return symbol
+    return None
+
+
+def getResolutionTable(primary, fallback=None):
+    # Every identifier either pack can resolve, mapped to its page in the
+    # order resolveSymbol would find it: the prefixed pages of the primary
+    # language first, then the primary and at last the fallback page of the
+    # same name. An identifier missing from the table is a miss in one probe.
+    indexes = (docphp_languages[primary]["symbolList"], fallback and docphp_languages[fallback]["symbolList"])
+    table = resolutionTables.get((primary, fallback))
+    if table and table["indexes"][0] is indexes[0] and table["indexes"][1] is indexes[1]:
+        return table["entries"]
+
+    # Page ids are stored as pageId * 2 + 1 for the fallback to keep the
+    # table small
+    entries = {}
+    for languageName, flag in [(fallback, 1), (primary, 0)]:
+        if not languageName:
+            continue
+        keys = indexes[flag].keys()
+        pageIds = dict((key, pageId * 2 + flag) for pageId, key in enumerate(keys))
+        for alias, key in docphp_languages[languageName]["aliases"].items():
+            # The aliases may already be of a refreshed pack, the table is
+            # built again for its index then
+            if key in pageIds:
+                entries[alias] = pageIds[key]
+        entries.update(pageIds)
+        if flag == 0:
+            # Only the primary's prefixed pages come before its own names
+            for prefix in ['class.', 'book.', 'function.']:
+                for key in keys:
+                    if key.startswith(prefix):
+                        entries[key[len(prefix):]] = pageIds[key]
+
+    resolutionTables[(primary, fallback)] = {"indexes": indexes, "entries": entries}
+    if getSetting('debug'):
+        print(package_name + ' resolution table for %s+%s: %d identifiers' % (primary, fallback, len(entries)))
+    return entries
+
+
+def resolveIdentifier(identifier, primary, fallback=None):
+    table = getResolutionTable(primary, fallback)
+    identifier = identifier.lower()
+    entry = table.get(identifier)
+    if entry is None and '_' in identifier:
+        entry = table.get(identifier.replace('_', '-'))
+    if entry is None:
+        return None
+    languageName = fallback if entry & 1 else primary
+    return languageName, docphp_languages[languageName]["symbolList"].key(entry >> 1)
+
+
+def getIdentifierAtPoint(view, pt):
+    # Reads the call around the cursor as the manual names it: DateTime::format
+    # and new DateTime as datetime.format and class.datetime, $dt->format as
+    # ->format and \Foo\Bar as foo-bar
+    if isinstance(pt, sublime.Region):
+        pt = pt.b
+    line = view.line(pt)
+    text = view.substr(line)
+    column = pt - line.a
+    for m in re.finditer('[A-Za-z_\\\\][A-Za-z0-9_\\\\]*', text):
+        if m.start() <= column <= m.end():
+            break
+    else:
+        return None
+
+    name = m.group(0).strip('\\').lower().replace('\\', '-')
+    if not name:
+        return None
+    before = text[:m.start()]
+    if re.search('->\s*$', before):
+        return '->' + name
+    scope = re.search('([A-Za-z0-9_\\\\]+)\s*::\s*$', before)
+    if scope:
+        scope = scope.group(1).strip('\\').lower().replace('\\', '-')
+        if scope in ['self', 'static', 'parent']:
+            return '->' + name
+        return scope + '.' + name
+    if re.search('\\bnew\s+$', before):
+        return 'class.' + name
+    return name
+
+
+def prefetchSymbol(symbol, languageName):
+    if languageName not in docphp_languages:
+        return
+    definitions = docphp_languages[languageName]["definition"]
+
+    content = definitions.peek(symbol)
+    if content is None:
+        content = getSymbolFromHtml(symbol, languageName)
+        definitions.put(symbol, content)
+
+    if getSetting('use_panel') == False and getSetting('render_cache_size'):
+        if not os.path.isfile(getRenderCacheFile(symbol, False, languageName)):
+            formatPopup(content, symbol, False, languageName)
+
+
+def prefetchView(view):
+    mode = getSetting('prefetch')
+    if not getSetting('auto') or not mode:
+        prefetcher.cancel()
+        return
+
+    primary = getSetting('language')
+    fallback = getSetting('language_fallback')
+    if primary not in docphp_languages:
+        prefetcher.cancel()
+        return
+
+    if mode == 'buffer':
+        scope = sublime.Region(0, view.size())
+    else:
+        scope = view.visible_region()
+    cursor = view.sel()[0].b if len(view.sel()) else scope.a
+
+    distances = {}
+    for region in view.find_by_selector('source.php'):
+        if not region.intersects(scope):
+            continue
+        region = region.intersection(scope)
+        for m in re.finditer('[A-Za-z_][A-Za-z0-9_]*', view.substr(region)):
+            word = m.group(0)
+            distance = abs(region.a + m.start() - cursor)
+            if distance < distances.get(word, distance + 1):
+                distances[word] = distance
+
+    if fallback not in docphp_languages or fallback == primary:
+        fallback = None
+    jobs = []
+    for word, distance in distances.items():
+        resolved = resolveIdentifier(word, primary, fallback)
+        if resolved:
+            jobs.append((distance, resolved[1], resolved[0]))
+
+    prefetcher.schedule(jobs)
+
+
+def probeDownload(url, validators=None):
+    headers = {'Range': 'bytes=0-0'}
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    try:
+        meta = {
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+        }
+        if response.status == 206:
+            m = re.search('/(\\d+)$', response.headers.get('Content-Range', ''))
+            return (int(m.group(1)) if m else None), True, meta
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), False, meta
+    finally:
+        response.close()
+
+
+def fetchRange(url, path, start, end, progress, tee=None):
+    # Appends to whatever an earlier attempt left in path, tee gets every
+    # byte of the file in order
+    have = os.path.getsize(path) if os.path.isfile(path) else 0
+    if tee and tee.offset < have:
+        with open(path, 'rb') as f:
+            f.seek(tee.offset)
+            while tee.offset < have:
+                tee.write(f.read(min(1048576, have - tee.offset)))
+    if end is not None and start + have > end:
+        return
+    headers = {}
+    if start + have > 0 or end is not None:
+        headers['Range'] = 'bytes=%d-%s' % (start + have, '' if end is None else end)
+
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # Nothing left to fetch, or the server file changed under us
+        os.unlink(path)
+        raise IOError('range not satisfiable, restarting')
+
+    with response:
+        if 'Range' in headers and response.status != 206:
+            if start > 0:
+                raise IOError('server does not support ranges')
+            have = 0
+        expected = None if end is None else end - start + 1 - have
+        progress(have)
+        if tee and not have:
+            tee.rewind()
+
+        chunksize = 65536
+        received = 0
+        with open(path, 'ab' if have else 'wb') as f:
+            while expected is None or received < expected:
+                began = time.time()
+                data = response.read(chunksize if expected is None else min(chunksize, expected - received))
+                if not data:
+                    break
+                f.write(data)
+                if tee:
+                    tee.write(data)
+                received += len(data)
+                progress(len(data))
+                # Grow the buffer while the connection keeps it full
+                if len(data) == chunksize and time.time() - began < 0.25 and chunksize < 1048576:
+                    chunksize *= 2
+
+    if expected is not None and received < expected:
+        raise IOError('short read, %d of %d bytes' % (received, expected))
+
+
+def fetchRangeWithRetries(url, path, start, end, progress, retries=3, tee=None):
+    for attempt in range(retries + 1):
+        try:
+            return fetchRange(url, path, start, end, progress, tee)
+        except urllib.error.HTTPError as e:
+            if e.code < 500 or attempt == retries:
+                raise
+        except (urllib.error.URLError, IOError, OSError, http.client.HTTPException, socket.timeout):
+            if attempt == retries:
+                raise
+        # The next attempt counts what is on disk again
+        progress(-os.path.getsize(path) if os.path.isfile(path) else 0)
+        time.sleep(attempt + 1)
+
+
+def downloadFile(url, filename, report=None, connections=1, validators=None, tee=None):
+    # Returns the ETag and Last-Modified of the download, or None when
+    # validators are given and the file has not changed since. tee gets
+    # the bytes of the file in order, unless the parts come in parallel.
+    probe = probeDownload(url, validators)
+    if probe is None:
+        return None
+    size, ranges, meta = probe
+    lock = threading.Lock()
+    state = {"done": 0, "reported": 0}
+
+    def progress(count):
+        with lock:
+            state["done"] += count
+            now = time.time()
+            if report and now - state["reported"] > 0.25:
+                state["reported"] = now
+                report(state["done"], size)
+
+    if connections > 1 and ranges and size and size > 1048576 and not os.path.isfile(filename):
+        if tee:
+            tee.abort()
+        step = -(-size // connections)
+        parts = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+        errors = []
+
+        # Parts left by an attempt with another number of connections
+        dirname, basename = os.path.split(filename)
+        current = [basename + '.%d-%d' % part for part in parts]
+        for name in os.listdir(dirname):
+            if re.match(re.escape(basename) + '\\.\\d+-\\d+$', name) and name not in current:
+                os.unlink(os.path.join(dirname, name))
+
+        def fetchPart(start, end):
+            try:
+                fetchRangeWithRetries(url, '%s.%d-%d' % (filename, start, end), start, end, progress)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fetchPart, args=part) for part in parts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        with open(filename + '.joining', 'wb') as output:
+            for start, end in parts:
+                with open('%s.%d-%d' % (filename, start, end), 'rb') as f:
+                    shutil.copyfileobj(f, output, 1048576)
+        os.replace(filename + '.joining', filename)
+        for start, end in parts:
+            os.unlink('%s.%d-%d' % (filename, start, end))
+    else:
+        fetchRangeWithRetries(url, filename, 0, size - 1 if size else None, progress, tee=tee)
+
+    if report:
+        report(os.path.getsize(filename), size)
+    # A pipe that inflated the whole download has checked it already
+    verifyArchive(filename, size, not (tee and tee.verify()))
+    return meta
+
+
+def buildAnchors(languageName, tarGzPath, storePath):
+    # Builds the store of a pack that was not built while downloading, with
+    # the anchors downloadPack would have returned
+    anchors = {}
+
+    def visit(symbol, page):
+        anchors[symbol] = getPageAnchors(page)
+
+    buildPageStore(languageName, tarGzPath, storePath, None, visit)
+    return anchors
+
+
+def downloadPack(languageName, filename, storePath, report=None, validators=None):
+    # Downloads a pack while another thread reads the same bytes as they
+    # arrive and repacks them into a page store at storePath, so the store
+    # is ready with the download instead of after another pass over the
+    # tarball. Returns the meta of downloadFile and the constant anchors
+    # of every page, which are None when the store was not built on the
+    # way, as for a download in parallel parts or one that started over.
+    anchors = {}
+    built = []
+
+    def visit(symbol, page):
+        anchors[symbol] = getPageAnchors(page)
+
+    def build(pipe):
+        try:
+            buildPageStore(languageName, filename, storePath, pipe, visit)
+            if pipe.finish():
+                built.append(True)
+        except Exception as e:
+            if getSetting('debug') and not pipe.broken:
+                print(package_name + ' building ' + languageName + ' while downloading failed: ' + str(e))
+
+    pipe = PackPipe(build)
+    try:
+        meta = downloadFile(getPackUrl(languageName), filename, report, getSetting('download_connections') or 1, validators, pipe)
+    except:
+        pipe.abort()
+        pipe.join()
+        if os.path.isfile(storePath):
+            os.unlink(storePath)
+        raise
+    pipe.close()
+    pipe.join()
+
+    if meta is None or not built or pipe.broken:
+        if os.path.isfile(storePath):
+            os.unlink(storePath)
+        return meta, None
+    return meta, anchors
+
+
+class PackPipe:
+
+    """Bytes of a download, inflated on their way to a thread that reads
+    them as a tar stream"""
+
+    def __init__(self, reader):
+        # The reader starts with the first byte, so not for a pack that
+        # turns out to be unchanged
+        self.reader = reader
+        self.thread = None
+        self.chunks = queue.Queue(64)
+        # gzip framing, the crc and length at the end are checked by zlib
+        self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.chunk = b''
+        self.position = 0
+        self.offset = 0
+        self.ended = False
+        self.broken = False
+        self.drained = False
+        self.verified = False
+
+    def start(self):
+        def run():
+            try:
+                self.reader(self)
+            finally:
+                # Nobody reads any more, the rest is dropped
+                self.drained = True
+
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    def put(self, data):
+        while not self.broken and not self.drained:
+            try:
+                self.chunks.put(data, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, data):
+        if not self.thread and not self.broken:
+            self.start()
+        self.offset += len(data)
+        self.put(data)
+
+    def rewind(self):
+        # The download starts over, what was read of it is of no use
+        if self.offset:
+            self.abort()
+
+    def close(self):
+        self.put(b'')
+
+    def abort(self):
+        self.broken = True
+
+    def finish(self):
+        # The tar reader stops at the end of archive marker, the rest is
+        # inflated too for gzip to check the whole download
+        while self.read(1048576):
+            pass
+        self.verified = self.inflater.eof and not self.inflater.unused_data
+        return self.verified
+
+    def verify(self):
+        # Whether the reader went through the whole download and found it
+        # intact, which spares inflating it once more
+        if not self.thread:
+            return False
+        self.close()
+        self.thread.join()
+        return self.verified and not self.broken
+
+    def read(self, size=-1):
+        while self.position == len(self.chunk) and not self.ended:
+            if self.broken:
+                raise IOError('download interrupted')
+            try:
+                chunk = self.chunks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if chunk:
+                self.chunk = self.inflater.decompress(chunk)
+            else:
+                self.chunk = self.inflater.flush()
+                self.ended = True
+            self.position = 0
+        end = len(self.chunk) if size < 0 else self.position + size
+        data = self.chunk[self.position:end]
+        self.position += len(data)
+        return data
+
+
+def verifyArchive(filename, size=None, inflate=True):
+    try:
+        if size is not None and os.path.getsize(filename) != size:
+            raise IOError('size mismatch, %d of %d bytes' % (os.path.getsize(filename), size))
+        # Reading to the end checks the CRC and length stored by gzip
+        if inflate:
+            with gzip.open(filename, 'rb') as f:
+                while f.read(1048576):
+                    pass
+    except (IOError, OSError, EOFError, zlib.error) as e:
+        os.unlink(filename)
+        raise IOError('corrupt download: ' + str(e))
+
+
+def getPackUrl(languageName):
+    return 'https://php.net/distributions/manual/php_manual_' + languageName + '.tar.gz'
+
+
+def getPackMeta(languageName):
+    try:
+        with open(getTarGzPath(languageName) + '.json', 'r', encoding='utf8') as f:
+            return sublime.decode_value(f.read())
+    except (OSError, IOError, ValueError):
+        return {}
+
+
+def setPackMeta(languageName, meta):
+    with open(getTarGzPath(languageName) + '.json', 'w', encoding='utf8') as f:
+        f.write(sublime.encode_value(meta))
+
+
+def refreshLanguage(languageName, report=None):
+    meta = getPackMeta(languageName)
+    filename = getTarGzPath(languageName) + '.downloading'
+    newStorePath = getPageStorePath(languageName) + '.new'
+    validators, anchors = downloadPack(languageName, filename, newStorePath, report, meta)
+    meta["checked"] = time.time()
+    if validators is None:
+        setPackMeta(languageName, meta)
+        return False
+    meta.update(validators)
+
+    symbols = getSymbolIndex(languageName)
+    old = dict((symbols.key(pageId), symbols.page(pageId)) for pageId in range(len(symbols)))
+    if anchors is None:
+        anchors = buildAnchors(languageName, filename, newStorePath)
+    with zipfile.ZipFile(newStorePath) as store:
+        new = dict((symbol, (size, crc)) for symbol, size, crc in getStoreEntries(store))
+    changed = [symbol for symbol in old if symbol in new and tuple(old[symbol]) != new[symbol]]
+    removed = [symbol for symbol in old if symbol not in new]
+
+    # Renders of the old pages are left to age out of the render cache,
+    # another language may still have those pages
+    replaceLanguageFiles(languageName, filename, newStorePath, anchors, changed + removed)
+    compactSharedStore()
+
+    index = searchIndexes.get(languageName) or SearchIndex(languageName)
+    index.update(changed, removed)
+    if getSetting('search_index'):
+        index.startBuilding()
+
+    setPackMeta(languageName, meta)
+    if getSetting('debug'):
+        print(package_name + ' refreshed %s: %d changed, %d removed, %d added pages' % (
+            languageName, len(changed), len(removed), len(new) - len(old) + len(removed)))
+    return True
 
-    if symbol not in symbolList:
-        if not fallback and getSetting('language_fallback'):
-            return getSymbolDescription(symbol, getSetting('language_fallback'), True)
+
+def refreshLanguagesInBackground():
+    # A download may take minutes, so not on the worker that renders the popups
+    thread = threading.Thread(target=refreshLanguages)
+    thread.daemon = True
+    thread.start()
+
+
+def refreshLanguages():
+    days = getSetting('refresh_days')
+    if not days:
+        return
+    for languageName in getSetting('languages') or {}:
+        if not os.path.isfile(getPageStorePath(languageName)):
+            continue
+        checked = getPackMeta(languageName).get("checked") or os.path.getmtime(getTarGzPath(languageName))
+        if time.time() - checked > days * 86400:
+            try:
+                with refreshLock:
+                    refreshLanguage(languageName)
+            except Exception as e:
+                if getSetting('debug'):
+                    print(package_name + ' refreshing ' + languageName + ' failed: ' + str(e))
+    sublime.set_timeout_async(refreshLanguagesInBackground, 3600000)
+
+
+class Prefetcher:
+
+    """Warms the page caches for symbols near the cursor on worker threads"""
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        self.generation = 0
+        self.workers = []
+
+    def schedule(self, jobs):
+        self.generation += 1
+        generation = self.generation
+        self.start()
+        for distance, symbol, languageName in jobs:
+            self.queue.put((distance, generation, symbol, languageName))
+
+    def cancel(self):
+        # Queued jobs carry the generation they were scheduled in and are
+        # dropped by the workers once it is outdated
+        self.generation += 1
+
+    def start(self):
+        threads = getSetting('prefetch_threads') or 1
+        while len(self.workers) < threads:
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        self.cancel()
+        for worker in self.workers:
+            self.queue.put((-1, None, '', ''))
+        self.workers = []
+
+    def work(self):
+        while True:
+            distance, generation, symbol, languageName = self.queue.get()
+            if generation is None:
+                return
+            if generation != self.generation:
+                continue
+            try:
+                prefetchSymbol(symbol, languageName)
+            except Exception as e:
+                if getSetting('debug'):
+                    print(package_name + ' prefetch ' + symbol + ': ' + str(e))
+
+
+class SymbolIndex:
+
+    """Sorted, memory mapped table of the pages in a language pack
+
+    The file is a header, one (name offset, size, crc) record per page and
+    the page names. Page ids are positions in the sorted table.
+    """
+
+    magic = b'DOCPHPIX'
+    version = 1
+    header = struct.Struct('<8sHII16sI')
+    record = struct.Struct('<III')
+
+    def __init__(self, path, fingerprint):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError('empty symbol index')
+        try:
+            self.validate(fingerprint)
+        except ValueError:
+            self.close()
+            raise
+
+    def validate(self, fingerprint):
+        if len(self.map) < self.header.size:
+            raise ValueError('truncated symbol index')
+        magic, version, self.count, blobSize, indexFingerprint, checksum = self.header.unpack_from(self.map)
+        if magic != self.magic or version != self.version:
+            raise ValueError('unknown symbol index format')
+        if indexFingerprint != fingerprint:
+            raise ValueError('stale symbol index')
+        self.blob = self.header.size + self.count * self.record.size
+        if len(self.map) != self.blob + blobSize:
+            raise ValueError('truncated symbol index')
+        if zlib.crc32(self.map[self.header.size:]) & 0xffffffff != checksum:
+            raise ValueError('corrupt symbol index')
+
+    @classmethod
+    def build(cls, path, fingerprint, entries):
+        entries = sorted((name.encode(), size, crc) for name, size, crc in entries)
+        records = []
+        names = []
+        offset = 0
+        for name, size, crc in entries:
+            records.append(cls.record.pack(offset, size, crc))
+            names.append(name)
+            offset += len(name)
+        body = b''.join(records) + b''.join(names)
+        header = cls.header.pack(cls.magic, cls.version, len(entries), offset, fingerprint, zlib.crc32(body) & 0xffffffff)
+
+        with open(path + '.tmp', 'wb') as f:
+            f.write(header + body)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def keyBytes(self, pageId):
+        start = self.record.unpack_from(self.map, self.header.size + pageId * self.record.size)[0]
+        if pageId + 1 < self.count:
+            end = self.record.unpack_from(self.map, self.header.size + (pageId + 1) * self.record.size)[0]
         else:
-            return None, None
-    elif symbol not in docphp_languages[language]["definition"]:
-        output = getSymbolFromHtml(symbol)
+            end = len(self.map) - self.blob
+        return self.map[self.blob + start:self.blob + end]
+
+    def key(self, pageId):
+        return self.keyBytes(pageId).decode()
+
+    def page(self, pageId):
+        _, size, crc = self.record.unpack_from(self.map, self.header.size + pageId * self.record.size)
+        return size, crc
+
+    def pageId(self, symbol):
+        name = symbol.encode()
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            key = self.keyBytes(middle)
+            if key < name:
+                low = middle + 1
+            elif key > name:
+                high = middle
+            else:
+                return middle
+        return -1
 
-        docphp_languages[language]["definition"][symbol] = output
-    return symbol, docphp_languages[language]["definition"][symbol]
+    def __contains__(self, symbol):
+        return self.pageId(symbol) != -1
 
+    def __getitem__(self, symbol):
+        if self.pageId(symbol) == -1:
+            raise KeyError(symbol)
+        return 'php-chunked-xhtml/' + symbol + '.html'
 
-def getSymbolFromHtml(symbol):
+    def keys(self):
+        return [self.key(pageId) for pageId in range(self.count)]
 
-    tar = getTarHandler()
 
-    member = tar.getmember(docphp_languages[language]["symbolList"][symbol])
-    f = tar.extractfile(member)
-    output = f.read().decode(errors='ignore')
+class SearchIndex:
 
-    dic = {
-        '&mdash;': chr(8212),
-        '&quot;': '"',
-        '<br>': '',
-        '&#039;': "'",
-        '&$': "&amp;$",
-        '&raquo;': chr(187),
-    }
-    pattern = "|".join(map(re.escape, dic.keys()))
+    """Inverted index over the text of the manual, saved in segments so that
+    a partial index can be searched and an interrupted build resumed"""
 
-    output = re.sub(pattern, lambda m: dic[m.group()], output)
+    version = 1
+    segmentSize = 500
 
-    return output
+    def __init__(self, languageName):
+        self.languageName = languageName
+        self.path = getSearchIndexPath(languageName)
+        self.lock = threading.Lock()
+        self.pages = []
+        self.postings = {}
+        self.descriptions = {}
+        self.segments = 0
+        self.total = None
+        self.complete = False
+        self.builder = None
+        self.stopped = False
+        self.loaded = False
+
+    def getManifest(self):
+        return {
+            "version": self.version,
+            "fingerprint": hashlib.md5(getPageStoreFingerprint(self.languageName)).hexdigest(),
+            "segments": self.segments,
+            "total": self.total,
+            "complete": self.complete,
+        }
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.path + 'manifest.json', 'r', encoding='utf8') as f:
+                manifest = sublime.decode_value(f.read())
+            expected = self.getManifest()
+            if manifest["version"] != expected["version"] or manifest["fingerprint"] != expected["fingerprint"]:
+                raise ValueError('stale search index')
+            for number in range(manifest["segments"]):
+                with open(self.path + '%d.json' % number, 'r', encoding='utf8') as f:
+                    self.addSegment(sublime.decode_value(f.read()))
+            self.total = manifest["total"]
+            self.complete = manifest["complete"]
+        except (OSError, IOError, ValueError, KeyError) as e:
+            if getSetting('debug'):
+                print(package_name + ' search index for ' + self.languageName + ' starts over: ' + str(e))
+            self.pages = []
+            self.postings = {}
+            self.descriptions = {}
+            self.segments = 0
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+
+    def addSegment(self, segment):
+        with self.lock:
+            offset = len(self.pages)
+            self.pages.extend(tuple(page) for page in segment["pages"])
+            for symbol, name, description in segment["pages"]:
+                self.descriptions[symbol] = description
+            for term, entries in segment["postings"].items():
+                if term not in self.postings:
+                    self.postings[term] = (array.array('I'), array.array('f'))
+                pages, weights = self.postings[term]
+                pages.extend(offset + entry for entry in entries[0::2])
+                weights.extend(entries[1::2])
+            self.segments += 1
+
+    def progress(self):
+        if self.complete or not self.total:
+            return 1 if self.complete else 0
+        return len(self.pages) / self.total
+
+    def startBuilding(self):
+        if (self.loaded and self.complete) or (self.builder and self.builder.is_alive()):
+            return
+        self.stopped = False
+        self.builder = threading.Thread(target=self.build)
+        self.builder.daemon = True
+        self.builder.start()
+
+    def stopBuilding(self):
+        self.stopped = True
+
+    def indexPages(self, symbols):
+        segment = {"pages": [], "postings": {}}
+        for symbol in symbols:
+            if self.stopped:
+                return None
+            page = readPage(self.languageName, symbol)
+            name, description, weights = getSearchDocument(symbol, transformPage(page.decode(errors='ignore')))
+            number = len(segment["pages"])
+            segment["pages"].append([symbol, name, description])
+            for term, weight in weights.items():
+                segment["postings"].setdefault(term, []).extend([number, round(weight, 2)])
+        return segment
+
+    def saveManifest(self):
+        with open(self.path + 'manifest.json', 'w', encoding='utf8') as f:
+            f.write(sublime.encode_value(self.getManifest()))
+
+    def build(self):
+        if not self.loaded:
+            self.load()
+        if self.complete:
+            return
+        try:
+            symbols = sorted(getSymbolIndex(self.languageName).keys())
+            self.total = len(symbols)
+            symbols = [symbol for symbol in symbols if symbol not in self.descriptions]
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            for begin in range(0, len(symbols), self.segmentSize):
+                segment = self.indexPages(symbols[begin:begin + self.segmentSize])
+                if segment is None:
+                    return
+
+                with open(self.path + '%d.json' % self.segments, 'w', encoding='utf8') as f:
+                    f.write(sublime.encode_value(segment))
+                self.addSegment(segment)
+                self.complete = begin + self.segmentSize >= len(symbols)
+                self.saveManifest()
+            self.complete = True
+        except Exception as e:
+            if getSetting('debug'):
+                print(package_name + ' search indexing ' + self.languageName + ' failed: ' + str(e))
+
+    def update(self, changed, removed):
+        # Reindexes the pages of a refreshed pack that is already in place,
+        # segments without changed pages are kept as they are
+        self.stopBuilding()
+        if self.builder:
+            self.builder.join()
+        stale = set(changed) | set(removed)
+        try:
+            with open(self.path + 'manifest.json', 'r', encoding='utf8') as f:
+                manifest = sublime.decode_value(f.read())
+            for number in range(manifest["segments"]):
+                with open(self.path + '%d.json' % number, 'r', encoding='utf8') as f:
+                    segment = sublime.decode_value(f.read())
+                symbols = [page[0] for page in segment["pages"]]
+                if stale.isdisjoint(symbols):
+                    continue
+                self.stopped = False
+                segment = self.indexPages([symbol for symbol in symbols if symbol not in removed])
+                with open(self.path + '%d.json' % number, 'w', encoding='utf8') as f:
+                    f.write(sublime.encode_value(segment))
+            self.segments = manifest["segments"]
+            self.total = manifest["total"]
+            # New pages are picked up by the next build
+            self.complete = False
+            self.saveManifest()
+        except (OSError, IOError, ValueError, KeyError) as e:
+            if getSetting('debug'):
+                print(package_name + ' search index update for ' + self.languageName + ' failed: ' + str(e))
+        with self.lock:
+            self.pages = []
+            self.postings = {}
+            self.descriptions = {}
+            self.segments = 0
+        self.stopped = False
+        self.loaded = False
+
+    def search(self, query, limit=50):
+        terms = list(set(getSearchTerms(query)))
+        scores = {}
+        matched = {}
+        with self.lock:
+            for term in terms:
+                if term not in self.postings:
+                    continue
+                pages, weights = self.postings[term]
+                idf = math.log(1 + len(self.pages) / len(pages))
+                for page, weight in zip(pages, weights):
+                    scores[page] = scores.get(page, 0) + weight * idf
+                    matched[page] = matched.get(page, 0) + 1
+            # Pages that contain every word of the query come first
+            ranked = heapq.nlargest(limit, scores, key=lambda page: (matched[page], scores[page]))
+            return [self.pages[page] for page in ranked]
+
+
+class DefinitionCache:
+
+    """LRU of raw pages, bounded by the memory they take"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        return self.items.get(key)
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.items:
+                self.size -= sys.getsizeof(self.items.pop(key))
+            self.items[key] = value
+            self.size += sys.getsizeof(value)
+            # Always keep the newest page, even when it alone exceeds the budget
+            while self.size > self.budget and len(self.items) > 1:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.items:
+                self.size -= sys.getsizeof(self.items.pop(key))
+
+    def stats(self):
+        return '%d hits, %d misses, %d evictions, %d pages, %.0f/%.0f KB' % (
+            self.hits, self.misses, self.evictions, len(self.items), self.size / 1024, self.budget / 1024)
 
 
 class DocphpShowDefinitionCommand(sublime_plugin.TextCommand):
     history = []
     currentSymbol = ''
+    currentLanguage = ''
+    requestId = 0
+    requestPoint = False
+    placeholder = False
+    # Milliseconds before a page that is still rendering gets a placeholder
+    placeholderDelay = 80
+    # Rendered pages of the open popup, for history.back and prefetched links
+    pagesLimit = 32
     projectSymbols = []
     window = False
     projectView = False
 
+    def __init__(self, view):
+        super().__init__(view)
+        self.history = []
+        self.pages = OrderedDict()
+
     def is_enabled(self, **args):
         selection = self.view.sel()
         force = args.get('force')
@@ -295,11 +2451,19 @@ class DocphpShowDefinitionCommand(sublime_plugin.TextCommand):
     def want_event(self):
         return True
 
+    def loaded(self, future, symbol, force):
+        # A load that failed is reported rather than started over
+        if not future.exception() and future.result():
+            self.view.run_command('docphp_show_definition', {"symbol": symbol, "force": force})
+        else:
+            languageExists(language)
+
     def run(self, edit, event=None, symbol=None, force=False):
         global language, currentView
         view = self.view
         currentView = view
         pt = False
+        lookupBegin = stageClock()
 
         language = getSetting('language')
 
@@ -313,40 +2477,172 @@ class DocphpShowDefinitionCommand(sublime_plugin.TextCommand):
             else:
                 pt = view.sel()[0]
             self.pt = pt
-            symbol, locations = sublime_symbol.symbol_at_point(view, pt)
+            begin = stageClock()
+            symbol = getIdentifierAtPoint(view, pt)
+            if not symbol:
+                symbol, locations = sublime_symbol.symbol_at_point(view, pt)
+            recordStage('symbol at point', begin, symbol)
+
+        if language not in docphp_languages and not daemonAvailable():
+            future = loadLanguageAsync(language, True)
+            if not future.done():
+                # Show it once the language is ready instead of freezing meanwhile
+                sublime.status_message(package_name + ': loading ' + language + ' manual...')
+                future.add_done_callback(lambda future: sublime.set_timeout(
+                    lambda: self.loaded(future, symbol, force), 0))
+                return
 
         translatedSymbol = symbol.replace('_', '-')
 
         # symbol = 'basename'
 
-        translatedSymbol, symbolDescription = getSymbolDescription(translatedSymbol)
+        if getSetting('use_panel') != False:
+            self.requestId += 1
+            requestId = self.requestId
+            sublime.set_timeout_async(lambda: self.render_panel(requestId, translatedSymbol, lookupBegin), 0)
+            return
 
-        if not symbolDescription:
-            if getSetting('prompt_when_not_found'):
-                view.show_popup('not found', sublime.COOPERATE_WITH_AUTO_COMPLETE)
-                return
+        if pt is False and not force and len(view.sel()):
+            pt = view.sel()[0]
+        self.requestPoint = pt.b if isinstance(pt, sublime.Region) else pt
+        self.request(translatedSymbol, False, False, lookupBegin)
+
+    def request(self, symbol, can_back, navigating, lookupBegin=None, part=0):
+        # Pages are read and rendered on a worker, every request supersedes
+        # the ones before it and a result that arrives late is dropped
+        self.requestId += 1
+        requestId = self.requestId
+
+        page = self.pages.get((language, symbol, can_back, part)) if navigating else None
+        if page:
+            countStat('popup page hit')
+            self.present(requestId, page[0], page[1], True, navigating, lookupBegin, can_back, part)
             return
+        cached = getCachedPopup(symbol, can_back, part)
+        if cached:
+            self.present(requestId, cached[0], cached[1], True, navigating, lookupBegin, can_back, part)
+            return
+        sublime.set_timeout(lambda: self.show_placeholder(requestId, symbol, navigating), self.placeholderDelay)
+        sublime.set_timeout_async(lambda: self.render(requestId, symbol, can_back, navigating, lookupBegin, part), 0)
 
-        if getSetting('use_panel') == False:
-            self.show_popup(translatedSymbol, symbolDescription)
+    def render(self, requestId, symbol, can_back, navigating, lookupBegin, part=0):
+        global language
+        if requestId != self.requestId:
+            return
+        response = daemonRequest({"op": "popup", "symbol": symbol, "can_back": can_back, "part": part})
+        if response and response["found"] is not False:
+            language = response["language"]
+            symbol, output, content = response["symbol"], response["output"], response["found"]
         else:
-            self.show_panel(translatedSymbol, symbolDescription, edit)
+            language, symbol, output, content = renderSymbol(symbol, can_back, part)
+        sublime.set_timeout(lambda: self.present(requestId, symbol, output, content, navigating, lookupBegin, can_back, part), 0)
 
-    def show_popup(self, symbol, symbolDescription):
-        output = symbolDescription
+    def present(self, requestId, symbol, output, content, navigating, lookupBegin, can_back=False, part=0):
+        if requestId != self.requestId:
+            countStat('stale popup')
+            return
+        self.requestId += 1
+        view = self.view
 
-        if getSetting('debug'):
-            print(output)
+        if navigating:
+            if not view.is_popup_visible():
+                return
+        elif self.requestPoint is not False:
+            # The cursor went on to another identifier meanwhile
+            if not len(view.sel()) or (view.sel()[0].b != self.requestPoint and
+                                       getIdentifierAtPoint(view, view.sel()[0]) != getIdentifierAtPoint(view, self.requestPoint)):
+                countStat('stale popup')
+                self.hide_placeholder()
+                return
+
+        if output is None:
+            if content is None and not navigating and getSetting('prompt_when_not_found'):
+                self.placeholder = False
+                view.show_popup('not found', sublime.COOPERATE_WITH_AUTO_COMPLETE)
+            else:
+                self.hide_placeholder()
+            return
 
         self.currentSymbol = symbol
+        self.currentLanguage = language
+        if navigating or (self.placeholder and view.is_popup_visible()):
+            self.update_popup(symbol, output)
+        else:
+            self.show_popup(symbol, output)
+        self.placeholder = False
+        recordStage('lookup', lookupBegin, symbol)
+
+        pages = self.pages
+        self.remember(pages, (language, symbol, can_back, part), symbol, output)
+        if getSetting('popup_prefetch_links'):
+            requestId = self.requestId
+            sublime.set_timeout_async(lambda: self.prefetch_links(requestId, pages, language, output), 0)
+
+    def remember(self, pages, key, symbol, output):
+        # Results of a popup that was closed meanwhile are dropped
+        if pages is not self.pages:
+            return
+        pages[key] = (symbol, output)
+        pages.move_to_end(key)
+        while len(pages) > self.pagesLimit:
+            pages.popitem(last=False)
+
+    def prefetch_links(self, requestId, pages, languageName, output):
+        # Links are followed with a back link, so that is how they are
+        # rendered, and a new request stops this to have the worker first
+        links = []
+        for link in popupLinkPattern.findall(output):
+            if link not in links:
+                links.append(link)
+        for link in links[:getSetting('popup_prefetch_links')]:
+            key = (languageName, link, True, 0)
+            if requestId != self.requestId or pages is not self.pages:
+                return
+            if key in pages:
+                continue
+            response = daemonRequest({"op": "popup", "symbol": link, "can_back": True})
+            if response:
+                if not response["output"]:
+                    continue
+                key = (response["language"], link, True, 0)
+                symbol, output = response["symbol"], response["output"]
+            else:
+                if languageName not in docphp_languages:
+                    return
+                symbol = resolveSymbol(link, docphp_languages[languageName]["symbolList"], False)
+                if not symbol:
+                    continue
+                definitions = docphp_languages[languageName]["definition"]
+                content = definitions.peek(symbol)
+                if content is None:
+                    content = getSymbolFromHtml(symbol, languageName)
+                    definitions.put(symbol, content)
+                output = formatPopup(content, symbol, True, languageName)
+            countStat('popup link prefetch')
+            sublime.set_timeout(lambda key=key, symbol=symbol, output=output: self.remember(pages, key, symbol, output), 0)
+
+    def show_placeholder(self, requestId, symbol, navigating):
+        # A popup that is already open stays until the result replaces it
+        if requestId != self.requestId or navigating or self.view.is_popup_visible():
+            return
+        self.placeholder = True
+        self.show_popup(symbol, '<style>' + getPopupStyle() + '</style><div id="outer"><div id="container">'
+                        '<p>Loading ' + symbol + '...</p></div></div>')
+
+    def hide_placeholder(self):
+        # Nothing is coming to replace it
+        if self.placeholder:
+            self.placeholder = False
+            self.view.hide_popup()
 
+    def show_popup(self, symbol, output):
         width, height = self.view.viewport_extent()
-        output = self.formatPopup(output, symbol=symbol)
 
         # It seems sublime will core when the output is too long
         # In some cases the value can set to 76200, but we use a 65535 for safety.
-        output = output[:65535]
+        output = output[:popupSizeLimit]
 
+        begin = stageClock()
         self.view.show_popup(
             output,
             flags=sublime.COOPERATE_WITH_AUTO_COMPLETE | sublime.HTML,
@@ -356,33 +2652,85 @@ class DocphpShowDefinitionCommand(sublime_plugin.TextCommand):
             on_navigate=self.on_navigate,
             on_hide=self.on_hide
         )
+        recordStage('show', begin, symbol)
 
-    def show_panel(self, symbol, symbolDescription, edit):
-        output = self.formatPanel(symbolDescription)
+    def update_popup(self, symbol, output):
+        output = output[:popupSizeLimit]
+        begin = stageClock()
+        self.view.update_popup(output)
+        recordStage('show', begin, symbol)
+
+    def render_panel(self, requestId, symbol, lookupBegin):
+        if requestId != self.requestId:
+            return
+        response = daemonRequest({"op": "panel", "symbol": symbol})
+        if response and response["found"] is not False:
+            symbol, content = response["symbol"], response["found"]
+            text = response["output"] or ''
+            chunks = (text[begin:begin + panelChunkSize] for begin in range(0, len(text), panelChunkSize))
+        else:
+            symbol, content = getSymbolDescription(symbol)
+            chunks = content and formatPanelChunks(content, symbol, language)
+        if not content:
+            if content is None and getSetting('prompt_when_not_found'):
+                sublime.set_timeout(lambda: self.view.show_popup('not found', sublime.COOPERATE_WITH_AUTO_COMPLETE), 0)
+            return
+
+        begin = stageClock()
+        first = True
+        for chunk in chunks:
+            if requestId != self.requestId:
+                return
+            sublime.set_timeout(lambda chunk=chunk, first=first: self.write_panel(requestId, chunk, first), 0)
+            first = False
+        recordStage('render panel', begin, symbol)
+        sublime.set_timeout(lambda: self.write_panel(requestId, '\n', False, symbol, lookupBegin), 0)
+
+    def write_panel(self, requestId, chunk, first, symbol=None, lookupBegin=None):
+        # The panel only ever holds the latest page
+        if requestId != self.requestId:
+            return
         name = 'docphp'
         window = self.view.window()
         panel = window.get_output_panel(name)
-        window.run_command("show_panel", {"panel": "output."+name})
-        panel.set_read_only(False)
-        panel.insert(edit, panel.size(), output + '\n')
-        panel.set_read_only(True)
+        if first:
+            window.run_command("show_panel", {"panel": "output."+name})
+        panel.run_command('docphp_write_panel', {"characters": chunk, "replace": first})
+        if symbol:
+            recordStage('lookup', lookupBegin, symbol)
 
     def on_hide(self):
         self.currentSymbol = ''
         self.history = []
+        self.pages = OrderedDict()
+        self.placeholder = False
+        # Nothing is waiting for this popup any more
+        self.requestId += 1
 
     def on_navigate(self, url):
+        global language
         if re.search('^https?://', url):
             webbrowser.open_new(url)
             return True
 
+        if url == 'online':
+            webbrowser.open_new('http://php.net/manual/' + self.currentLanguage + '/' + self.currentSymbol + '.php')
+            return True
+
+        m = re.search('^more\.(\d+)$', url)
+        if m:
+            self.request(self.currentSymbol, len(self.history) > 0, True, stageClock(), int(m.group(1)))
+            return
+
         m = re.search('^(changeto|constant)\.(.*)', url)
         if m:
             if m.group(1) == 'changeto':
-                symbol, content = getSymbolDescription(self.currentSymbol, m.group(2))
+                language = m.group(2)
+                symbol = self.currentSymbol
             else:
                 self.view.run_command('docphp_insert', {"string": m.group(2)})
                 self.view.hide_popup()
+                return
 
         elif url == 'history.back':
             symbol = self.history.pop()
@@ -391,80 +2739,51 @@ class DocphpShowDefinitionCommand(sublime_plugin.TextCommand):
             self.history.append(self.currentSymbol)
             symbol = url[:url.find('.html')]
             self.currentSymbol = symbol
-        symbol, content = getSymbolDescription(symbol)
 
-        if content == False:
-            return False
-
-        content = self.formatPopup(content, symbol=symbol, can_back=len(self.history) > 0)
-
-        content = content[:65535]
-        self.view.update_popup(content)
-
-    def formatPopup(self, content, symbol, can_back=False):
-        if not isinstance(content, str):
-            return
-
-        content = decodeEntity(content)
-
-        parser = PopupHTMLParser(symbol, language, can_back)
-        try:
-            parser.feed(content)
-        except FinishError:
-            pass
-        content = parser.output
-        content = '<style>'+sublime.load_resource('Packages/' + package_name + '/style.css') + \
-            '</style><div id="outer"><div id="container">' + content + "</div></div>"
-        content = re.sub('<strong><code>([A-Z_]+)</code></strong>', '<strong><code><a class="constant" href="constant.\\1">\\1</a></code></strong>', content)
-        return content
-
-    def formatPanel(self, content):
-        if not isinstance(content, str):
-            return
-        content = decodeEntity(content)
-        content = re.sub('\s+', ' ', content)
-        content = re.sub('<(br\s*/?|/p|/div|/li|(div|p)\s[^<>]*|(div|p))>', '\n', content)
-        content = re.sub('<.*?>', '', content)
-        content = re.sub('\s+\n\s*\n\s+', '\n\n', content)
-        content = re.sub('^\s+', '', content, count=1)
-        content = decodeEntity(content, 'html')
-        return content
+        self.request(symbol, len(self.history) > 0, True, stageClock())
 
 
 class PopupHTMLParser(HTMLParser):
-    symbol = ''
-    language = ''
-    can_back = False
-    stack = []
-    output = ''
-    as_div = ['blockquote', 'tr', 'li', 'ul', 'dl', 'dt', 'dd', 'table', 'tbody', 'thead']
-    strip = ['td']
-    started = False
-    navigate_rendered = False
-    navigate_up = ''
-
-    def __init__(self, symbol, language, can_back):
+    as_div = frozenset(['blockquote', 'tr', 'li', 'ul', 'dl', 'dt', 'dd', 'table', 'tbody', 'thead'])
+    strip = frozenset(['td'])
+    bordered = frozenset(['div', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    borders = [
+        ('gray', re.compile('\\b(phpcode|classsynopsis|methodsynopsis|note|informaltable)\\b')),
+        ('blue', re.compile('\\b(tip)\\b')),
+        ('pink', re.compile('\\b(warning)\\b')),
+        ('yellow', re.compile('\\b(caution)\\b')),
+    ]
+    heading = re.compile('h[1-6]')
+    first_link = re.compile('.*?(<a.*?</a>).*')
+    unescaped_quote = re.compile('(?<!\\\\)"')
+    constant = re.compile('[A-Z_]+\\Z')
+
+    def __init__(self, symbol, can_back):
         self.symbol = symbol
-        self.language = language
         self.can_back = can_back
+        self.stack = []
+        self.buffer = []
+        self.navigate_rendered = False
+        # The buffer and its length when the "up" link was closed, the buffer
+        # is replaced rather than cleared so this stays valid
+        self.navigate_up = ([], 0)
         super().__init__()
 
+    @property
+    def output(self):
+        return ''.join(self.buffer)
+
     def parseAttrs(self, attrs):
         ret = {}
         for k, v in attrs:
             ret[k] = v
         return ret
 
-
     def handle_starttag(self, tag, attrs):
         attrs = self.parseAttrs(attrs)
 
-        for k in attrs:
-            v = attrs[k]
-            if k == 'id' and v == self.symbol:
-                self.output = ''
-            if k == 'class' and v == 'up':
-                self.output = ''
+        if attrs.get('id') == self.symbol or attrs.get('class') == 'up':
+            self.buffer = []
 
         if tag in self.as_div:
             if 'class' in attrs:
@@ -475,86 +2794,97 @@ class PopupHTMLParser(HTMLParser):
         if tag in self.strip:
             return
 
-        self.stack.append({'tag': tag, 'attrs': attrs})
         border = self.shall_border(tag, attrs)
+        self.stack.append((tag, attrs, border))
         if border:
-            self.output += '<div class="border border-' + border + '">'
-        self.output += self.get_tag_text(tag, attrs)
+            self.buffer.append('<div class="border border-' + border + '">')
+        self.buffer.append(self.get_tag_text(tag, attrs))
 
     def handle_endtag(self, tag):
         if tag in self.as_div:
             tag = 'div'
         if tag in self.strip:
             return
-        try:
-            while(True):
-                previous = self.stack.pop()
-                self.output += '</' + tag + '>'
-
-                if re.search('h[1-6]', tag):
-                    self.output += '<div class="horizontal-rule"></div>'
-                    if not self.navigate_rendered:
-                        self.navigate_rendered = True
-                        self.output += ('<a href="history.back">back</a>' if self.can_back else 'back') + '&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;<a href="http://php.net/manual/' + \
-                            self.language + '/' + self.symbol + '.php">online</a>' + \
-                            '&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;' + re.sub('.*?(<a.*?</a>).*', '\\1', self.navigate_up)
-                        languages, _ = getLanguageList(format='raw', getAll=False)
-                        if len(languages) > 1:
-                            self.output += '&nbsp;&nbsp;&nbsp;&nbsp;Change language:'
-                            for lang in languages:
-                                self.output += ' <a href="changeto.' + lang['shortName'] + '">' + lang['nativeName'] + '</a>'
-
-                if self.shall_border(previous['tag'], previous['attrs']):
-                    self.output += '</div>'
-                for k in previous['attrs']:
-                    v = previous['attrs'][k]
-                    if k == 'id' and v == self.symbol:
-                        raise FinishError
-                    if k == 'class' and v == 'up':
-                        self.navigate_up = self.output
-                if tag == previous['tag']:
-                    break
-
-        except IndexError:
-            pass
+        end = '</' + tag + '>'
+        is_heading = self.heading.search(tag)
+        while self.stack:
+            previous_tag, attrs, border = self.stack.pop()
+            self.buffer.append(end)
+
+            if tag == 'strong' and previous_tag == 'strong':
+                self.link_constant()
+
+            if is_heading:
+                self.buffer.append('<div class="horizontal-rule"></div>')
+                if not self.navigate_rendered:
+                    self.navigate_rendered = True
+                    self.buffer.append(self.get_navigation())
+
+            if border:
+                self.buffer.append('</div>')
+            if attrs.get('id') == self.symbol:
+                raise FinishError
+            if attrs.get('class') == 'up':
+                self.navigate_up = (self.buffer, len(self.buffer))
+            if tag == previous_tag:
+                break
 
     def handle_startendtag(self, tag, attrs):
+        attrs = self.parseAttrs(attrs)
         if tag in self.as_div:
             if 'class' in attrs:
                 attrs['class'] += ' ' + tag
             else:
                 attrs['class'] = tag
             tag = 'div'
-        self.output += self.get_tag_text(tag, attrs, True)
+        self.buffer.append(self.get_tag_text(tag, attrs, True))
 
     def handle_data(self, data):
-        self.output += data
-        pass
+        self.buffer.append(data)
 
     def handle_entityref(self, name):
-        self.output += '&' + name + ';'
+        self.buffer.append('&' + name + ';')
 
     def handle_charref(self, name):
-        self.output += '&' + name + ';'
+        self.buffer.append('&' + name + ';')
+
+    def link_constant(self):
+        # <strong><code>PREG_SPLIT_DELIM_CAPTURE</code></strong> becomes a
+        # link which inserts the constant
+        buffer = self.buffer
+        if len(buffer) >= 5 and buffer[-5] == '<strong>' and buffer[-4] == '<code>' and buffer[-2] == '</code>':
+            constant = buffer[-3]
+            if self.constant.match(constant):
+                buffer[-3] = '<a class="constant" href="constant.' + constant + '">' + constant + '</a>'
+
+    def close_tags(self):
+        while self.stack:
+            tag, attrs, border = self.stack.pop()
+            self.buffer.append('</' + tag + '>')
+            if border:
+                self.buffer.append('</div>')
+
+    def get_navigation(self):
+        buffer, length = self.navigate_up
+        navigate_up = ''.join(buffer[:length])
+        # The online link is made on click, a render does not depend on the
+        # language it was made for
+        return ('<a href="history.back">back</a>' if self.can_back else 'back') + \
+            '&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;<a href="online">online</a>' + \
+            '&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;' + self.first_link.sub('\\1', navigate_up) + getLanguageSwitch()
 
     def shall_border(self, tag, attrs):
-        if tag.lower() not in ['div', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+        if tag.lower() not in self.bordered or 'class' not in attrs:
             return False
-        for k in attrs:
-            v = attrs[k]
-            if k == 'class':
-                if re.search('\\b(phpcode|classsynopsis|methodsynopsis|note|informaltable)\\b', v):
-                    return 'gray'
-                elif re.search('\\b(tip)\\b', v):
-                    return 'blue'
-                elif re.search('\\b(warning)\\b', v):
-                    return 'pink'
-                elif re.search('\\b(caution)\\b', v):
-                    return 'yellow'
+        for border, pattern in self.borders:
+            if pattern.search(attrs['class']):
+                return border
         return False
 
     def get_tag_text(self, tag, attrs, is_startend=False):
-        return '<' + (tag + ' ' + ' '.join(map(lambda m: m + '="' + re.sub('(?<!\\\\)"', '\\"', attrs[m]) + '"', attrs))).rstrip() + (' />' if is_startend else '>')
+        if attrs:
+            tag += ' ' + ' '.join([k + '="' + self.unescaped_quote.sub('\\"', v) + '"' for k, v in attrs.items()])
+        return '<' + tag + (' />' if is_startend else '>')
 
 
 class DocphpCheckoutLanguageCommand(sublime_plugin.TextCommand):
@@ -614,62 +2944,43 @@ class DocphpCheckoutLanguageCommand(sublime_plugin.TextCommand):
     def downloadLanguageGZ(self, name):
         err = None
         try:
-            url = 'https://php.net/distributions/manual/php_manual_' + name + '.tar.gz'
+            url = getPackUrl(name)
 
             filename = getDocphpPath() + 'language/php_manual_' + name + '.tar.gz.downloading'
 
-            response = urllib.request.urlopen(url)
-            try:
-                if response.headers['Content-Length']:
-                    totalsize = int(response.headers['Content-Length'])  # assume correct header
+            def report(readsofar, totalsize):
+                if totalsize:
+                    percent = readsofar * 1e2 / totalsize
+                    sublime.status_message(package_name + ': %.0f%% checking out %s' % (percent, name,))
                 else:
-                    totalsize = None
-            except NameError:
-                totalsize = None
-            except KeyError:
-                totalsize = None
-
-            outputfile = open(filename, 'wb')
+                    kb = readsofar / 1024
+                    sublime.status_message(package_name + ': %.0f KB checking out %s' % (kb, name,))
 
-            readsofar = 0
-            chunksize = 8192
+            storePath = filename + '.pages.zip'
             try:
                 self.downloading = name
-                while(True):
-                    # download chunk
-                    data = response.read(chunksize)
-                    if not data:  # finished downloading
-                        break
-                    readsofar += len(data)
-                    outputfile.write(data)  # save to filename
-                    if totalsize:
-                        # report progress
-                        percent = readsofar * 1e2 / totalsize  # assume totalsize > 0
-                        sublime.status_message(package_name + ': %.0f%% checking out %s' % (percent, name,))
-                    else:
-                        kb = readsofar / 1024
-                        sublime.status_message(package_name + ': %.0f KB checking out %s' % (kb, name,))
+                # An unfinished .downloading file from an earlier attempt is resumed
+                meta, anchors = downloadPack(name, filename, storePath, report)
             finally:
-                outputfile.close()
                 self.downloading = False
-                if totalsize and readsofar != totalsize:
-                    os.unlink(filename)
-                    err = 'Download failed'
 
         except (urllib.error.HTTPError) as e:
             err = '%s: HTTP error %s contacting API' % (__name__, str(e.code))
         except (urllib.error.URLError) as e:
             err = '%s: URL error %s contacting API' % (__name__, str(e.reason))
         except Exception as e:
-            err = e.__class__.__name__
+            err = e.__class__.__name__ + ': ' + str(e)
 
         if not err:
-            if os.path.isdir(getI18nCachePath(name)):
-                shutil.rmtree(getI18nCachePath(name))
-            newname = getDocphpPath() + 'language/php_manual_' + name + '.tar.gz'
-            if os.path.isfile(newname):
-                os.unlink(newname)
-            os.rename(filename, newname)
+            unloadSearchIndex(name)
+            if anchors is None:
+                anchors = buildAnchors(name, filename, storePath)
+            # A language checked out again stays loaded on its old files
+            # until the new ones are in place
+            replaceLanguageFiles(name, filename, storePath, anchors)
+            compactSharedStore()
+            meta["checked"] = time.time()
+            setPackMeta(name, meta)
             return True
 
         print(err)
@@ -678,6 +2989,86 @@ class DocphpCheckoutLanguageCommand(sublime_plugin.TextCommand):
         return False
 
 
+class DocphpRefreshLanguageCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, languageName=None):
+        if languageName:
+            languageNames = [languageName]
+        else:
+            languageNames = list(getSetting('languages') or {})
+        # Not on the worker that renders the popups, like the prebuild
+        thread = threading.Thread(target=self.refresh, args=(languageNames,))
+        thread.daemon = True
+        thread.start()
+
+    def refresh(self, languageNames):
+        for languageName in languageNames:
+            def report(readsofar, totalsize):
+                if totalsize:
+                    sublime.status_message(package_name + ': %.0f%% refreshing %s' % (readsofar * 1e2 / totalsize, languageName))
+
+            try:
+                with refreshLock:
+                    refreshed = refreshLanguage(languageName, report)
+                if refreshed:
+                    sublime.status_message(package_name + ': ' + languageName + ' refreshed')
+                else:
+                    sublime.status_message(package_name + ': ' + languageName + ' is up to date')
+            except Exception as e:
+                print(e)
+                sublime.message_dialog('Language ' + languageName + ' refresh failed. Please try again.')
+
+
+class DocphpShowPerformanceStatsCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        if not getSetting('performance_stats'):
+            sublime.message_dialog('Set "performance_stats" to true in the settings of ' + package_name + ' to collect the timings of lookups.')
+            return
+        name = 'docphp'
+        window = self.view.window()
+        panel = window.get_output_panel(name)
+        window.run_command("show_panel", {"panel": "output." + name})
+        panel.run_command('docphp_write_panel', {"characters": getPerformanceReport() + '\n', "replace": True})
+
+
+class DocphpPrebuildCacheCommand(sublime_plugin.TextCommand):
+
+    building = False
+
+    def run(self, edit):
+        if DocphpPrebuildCacheCommand.building:
+            sublime.message_dialog('The cache is being prebuilt already.')
+            return
+        DocphpPrebuildCacheCommand.building = True
+        # Takes minutes, so not on the worker that renders the popups
+        thread = threading.Thread(target=self.prebuild, args=(list(getSetting('languages') or {}),))
+        thread.daemon = True
+        thread.start()
+
+    def prebuild(self, languageNames):
+        begin = time.time()
+        pages = 0
+        try:
+            for languageName in languageNames:
+                if not waitForLanguage(languageName):
+                    continue
+
+                def report(done, total, rate):
+                    sublime.status_message(package_name + ': prebuilding %s %.0f%%, %.0f pages/s' % (
+                        languageName, done * 1e2 / total, rate))
+
+                pages += prebuildLanguage(languageName, report)
+        except Exception as e:
+            print(e)
+            sublime.message_dialog('Prebuilding the cache failed, run the command again to resume.')
+            return
+        finally:
+            DocphpPrebuildCacheCommand.building = False
+            loadPrebuiltIndexInBackground()
+        sublime.message_dialog('Prebuilt %d pages in %.0f seconds.' % (pages, time.time() - begin))
+
+
 class DocphpSelectLanguageCommand(sublime_plugin.TextCommand):
 
     languageNameList = None
@@ -696,7 +3087,7 @@ class DocphpSelectLanguageCommand(sublime_plugin.TextCommand):
         if index != -1:
             language = re.search('^\w+', self.languageList[index]).group(0)
             setSetting('language', language)
-            loadLanguage()
+            loadLanguageAsync(language, True)
 
 
 class DocphpOpenManualIndexCommand(sublime_plugin.TextCommand):
@@ -719,14 +3110,13 @@ class DocphpSearchCommand(sublime_plugin.TextCommand):
         currentView = view
         if not languageExists():
             return
-        tar = getTarHandler()
         symbol = None
 
         if at_point:
             symbol = view.substr(view.word(view.sel()[0]))
 
-        files = list(map(lambda file: re.sub('-', '_', file), docphp_languages[language]["symbolList"].keys()))
-        files.sort()
+        panel = getSearchPanel()
+        files = panel["files"]
 
         def show(index):
             if index != -1:
@@ -736,13 +3126,47 @@ class DocphpSearchCommand(sublime_plugin.TextCommand):
         if event:
             pt = view.window_to_text((event["x"], event["y"]))
             symbol, locations = sublime_symbol.symbol_at_point(view, pt)
+        if symbol:
             for prefix in ['function.', 'book.', 'class.']:
-                try:
-                    selected_index = files.index(prefix + symbol)
+                selected_index = panel["positions"].get(prefix + symbol.lower(), -1)
+                if selected_index != -1:
                     break
-                except ValueError:
-                    pass
-        currentView.window().show_quick_panel(files, show, selected_index=selected_index)
+        currentView.window().show_quick_panel(panel["items"], show, selected_index=selected_index)
+
+
+class DocphpSearchTextCommand(sublime_plugin.TextCommand):
+
+    results = []
+
+    def run(self, edit, query=None):
+        global currentView
+        currentView = self.view
+        if not languageExists():
+            return
+        index = getSearchIndex()
+        index.startBuilding()
+
+        if query:
+            self.search(query)
+        else:
+            self.view.window().show_input_panel('Search manual text:', '', self.search, None, None)
+
+    def search(self, query):
+        index = getSearchIndex()
+        self.results = index.search(query)
+
+        if not index.complete:
+            sublime.status_message(package_name + ': search index %.0f%% built, results may be incomplete' % (index.progress() * 100))
+        if not self.results:
+            sublime.status_message(package_name + ': nothing found for ' + query)
+            return
+
+        items = [[name, description] for symbol, name, description in self.results]
+        self.view.window().show_quick_panel(items, self.show)
+
+    def show(self, index):
+        if index != -1:
+            currentView.run_command('docphp_show_definition', {"symbol": self.results[index][0], "force": True})
 
 
 class DocphpInsertCommand(sublime_plugin.TextCommand):
@@ -751,31 +3175,82 @@ class DocphpInsertCommand(sublime_plugin.TextCommand):
         self.view.insert(edit, self.view.sel()[0].b, string)
 
 
+class DocphpWritePanelCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, characters, replace=False):
+        view = self.view
+        view.set_read_only(False)
+        if replace:
+            view.replace(edit, sublime.Region(0, view.size()), characters)
+        else:
+            view.insert(edit, view.size(), characters)
+        view.set_read_only(True)
+
+
 class DocPHPListener(sublime_plugin.EventListener):
-    prevTime = 0
-    delaying = False
+    # Per view: the number of the latest selection change, only the timer
+    # armed by it goes on to a lookup, and the identifier looked up last
+    generations = {}
+    lastSymbols = {}
 
     def on_selection_modified_async(self, view):
         if not getSetting('auto'):
             return
         global currentView
         currentView = view
-        self.prevTime = time.time()
-        if not self.delaying:
-            sublime.set_timeout_async(self.doAutoShow, getSetting('auto_delay') + 50)
-            self.delaying = True
-
-    def doAutoShow(self):
-        delayTime = getSetting('auto_delay')
-        if (time.time() - self.prevTime) * 1000 > delayTime:
-            self.delaying = False
-            if not currentView.is_popup_visible():
-                currentView.run_command('docphp_show_definition')
-        else:
-            sublime.set_timeout_async(self.doAutoShow, int(delayTime - (time.time() - self.prevTime) * 1000) + 50)
+        viewId = view.id()
+        generation = self.generations.get(viewId, 0) + 1
+        self.generations[viewId] = generation
+        sublime.set_timeout_async(lambda: self.doAutoShow(view, generation), getSetting('auto_delay'))
+
+    def doAutoShow(self, view, generation):
+        viewId = view.id()
+        if self.generations.get(viewId) != generation:
+            countStat('auto superseded')
+            return
+        if not len(view.sel()) or view.is_popup_visible():
+            return
+        pt = view.sel()[0].b
+        if not view.score_selector(pt, 'source.php'):
+            self.lastSymbols.pop(viewId, None)
+            return
+        symbol = getIdentifierAtPoint(view, pt)
+        if not symbol:
+            self.lastSymbols.pop(viewId, None)
+            return
+        # Moving within the same identifier, or back onto one whose popup was
+        # just closed, does not look it up again
+        if symbol == self.lastSymbols.get(viewId):
+            countStat('auto same symbol')
+            return
+        self.lastSymbols[viewId] = symbol
+        view.run_command('docphp_show_definition', {"symbol": symbol})
+
+    def on_close(self, view):
+        self.generations.pop(view.id(), None)
+        self.lastSymbols.pop(view.id(), None)
+
+
+class DocPHPPrefetchListener(sublime_plugin.EventListener):
+
+    def on_activated_async(self, view):
+        prefetchView(view)
+
+    def on_load_async(self, view):
+        if view.window() and view == view.window().active_view():
+            prefetchView(view)
+
+    def on_post_save_async(self, view):
+        prefetchView(view)
+
+    def on_deactivated_async(self, view):
+        prefetcher.cancel()
 
 
 class FinishError(Exception):
 
     """For stopping the HTMLParser"""
     pass
+
+
+prefetcher = Prefetcher()
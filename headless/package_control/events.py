@@ -0,0 +1,6 @@
+def install(name):
+    return False
+
+
+def remove(name):
+    return False
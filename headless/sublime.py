@@ -0,0 +1,205 @@
+"""Just enough of the sublime module to run docphp.py outside of Sublime Text,
+for the daemon and the benchmark. Messages meant for the status bar and
+dialogs go to the docphp logger."""
+
+import json
+import logging
+import os
+import re
+import threading
+
+packagePath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cachePath = os.environ.get('DOCPHP_CACHE', '/tmp/docphp-bench')
+
+COOPERATE_WITH_AUTO_COMPLETE = 2
+HIDE_ON_MOUSE_MOVE_AWAY = 8
+HTML = 1
+KEEP_OPEN_ON_FOCUS_LOST = 2
+
+settings = {}
+logger = logging.getLogger('docphp')
+
+
+class Settings(dict):
+
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def erase(self, key):
+        self.pop(key, None)
+
+
+def load_settings(name):
+    if name not in settings:
+        with open(os.path.join(packagePath, name), encoding='utf8') as f:
+            settings[name] = Settings(decode_value(f.read()))
+    return settings[name]
+
+
+def save_settings(name):
+    pass
+
+
+def cache_path():
+    return cachePath
+
+
+def load_resource(name):
+    with open(os.path.join(packagePath, name.split('/', 2)[2]), encoding='utf8') as f:
+        return f.read()
+
+
+def decode_value(value):
+    value = re.sub('^\\s*//.*$', '', value, flags=re.M)
+    return json.loads(re.sub(',(\\s*[}\\]])', '\\1', value))
+
+
+def encode_value(value, pretty=False):
+    return json.dumps(value, indent=4 if pretty else None)
+
+
+def status_message(message):
+    logger.info(message)
+
+
+def error_message(message):
+    logger.error(message)
+
+
+def message_dialog(message):
+    logger.warning(message)
+
+
+def set_timeout(callback, delay=0):
+    timer = threading.Timer(delay / 1000.0, callback)
+    timer.daemon = True
+    timer.start()
+
+
+set_timeout_async = set_timeout
+
+
+def active_window():
+    return Window()
+
+
+class Region(object):
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, point):
+        return self.begin() <= point <= self.end()
+
+    def intersects(self, region):
+        return self.begin() < region.end() and region.begin() < self.end() or self.begin() == region.begin()
+
+    def intersection(self, region):
+        return Region(max(self.begin(), region.begin()), min(self.end(), region.end()))
+
+
+class View(object):
+
+    """A buffer holding text, which records the popups and panels shown on it"""
+
+    def __init__(self, text='', cursor=0):
+        self.text = text
+        self.cursor = cursor
+        self.popups = []
+
+    def id(self):
+        return id(self)
+
+    def window(self):
+        return Window(self)
+
+    def size(self):
+        return len(self.text)
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self.text[region]
+        return self.text[region.begin():region.end()]
+
+    def sel(self):
+        return [Region(self.cursor)]
+
+    def line(self, point):
+        if isinstance(point, Region):
+            point = point.b
+        begin = self.text.rfind('\n', 0, point) + 1
+        end = self.text.find('\n', point)
+        return Region(begin, len(self.text) if end == -1 else end)
+
+    def word(self, point):
+        if isinstance(point, Region):
+            point = point.b
+        for m in re.finditer('\\w+', self.text):
+            if m.start() <= point <= m.end():
+                return Region(m.start(), m.end())
+        return Region(point)
+
+    def visible_region(self):
+        return Region(0, min(len(self.text), 4000))
+
+    def viewport_extent(self):
+        return (2000, 2000)
+
+    def find_by_selector(self, selector):
+        return [Region(0, len(self.text))]
+
+    def score_selector(self, point, selector):
+        return 1
+
+    def show_popup(self, content, **kwargs):
+        self.popups.append(content)
+
+    def update_popup(self, content):
+        self.popups.append(content)
+
+    def is_popup_visible(self):
+        return False
+
+    def hide_popup(self):
+        pass
+
+    def run_command(self, name, args=None):
+        pass
+
+
+class Window(object):
+
+    def __init__(self, view=None):
+        self.view = view or View()
+        self.panels = []
+
+    def active_view(self):
+        return self.view
+
+    def get_output_panel(self, name):
+        return View()
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        self.panels.append(items)
+
+    def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+        pass
+
+    def run_command(self, name, args=None):
+        pass
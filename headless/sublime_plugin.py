@@ -0,0 +1,18 @@
+class TextCommand(object):
+
+    def __init__(self, view=None):
+        self.view = view
+
+
+class WindowCommand(object):
+
+    def __init__(self, window=None):
+        self.window = window
+
+
+class ApplicationCommand(object):
+    pass
+
+
+class EventListener(object):
+    pass
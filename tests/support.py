@@ -0,0 +1,166 @@
+"""Runs docphp.py headless for the tests: on the shim in headless/, with a
+synthetic pack in a temporary cache directory and a local HTTP server
+to download packs from"""
+
+import http.server
+import io
+import os
+import re
+import shutil
+import socketserver
+import sys
+import tarfile
+import tempfile
+import threading
+
+testsPath = os.path.dirname(os.path.abspath(__file__))
+packagePath = os.path.dirname(testsPath)
+sys.path.insert(0, packagePath)
+sys.path.insert(0, os.path.join(packagePath, 'headless'))
+sys.path.insert(0, os.path.join(packagePath, 'bench'))
+
+import sublime
+import synthetic
+
+languageName = 'xx'
+
+
+def loadDocphp(**settings):
+    """Points docphp at a new empty cache directory and returns it"""
+    cachePath = tempfile.mkdtemp(prefix='docphp-test-')
+    sublime.cachePath = cachePath
+    import docphp
+    unload(docphp)
+    current = sublime.load_settings(docphp.setting_file)
+    current.update({
+        "language": languageName,
+        "languages": {languageName: 'gz'},
+        "language_fallback": False,
+        "search_index": False,
+        "prefetch": False,
+        "refresh_days": 0,
+        "daemon_socket": False,
+        "download_connections": 1,
+        "debug": False,
+    })
+    current.update(settings)
+    docphp.currentSettings = current
+    docphp.currentView = sublime.View()
+    docphp.language = languageName
+    docphp.mainThread = threading.current_thread()
+    os.makedirs(docphp.getDocphpPath() + 'language')
+    return docphp
+
+
+def unload(docphp):
+    for name in list(docphp.docphp_languages.keys()) + list(docphp.languageLoads.keys()):
+        docphp.closeLanguageFiles(name)
+    docphp.closeSharedStore()
+    docphp.closePrebuilt()
+    docphp.docphp_languages.clear()
+    docphp.languageLoads.clear()
+    docphp.resolutionTables.clear()
+
+
+def removeCache(docphp):
+    unload(docphp)
+    shutil.rmtree(sublime.cachePath, True)
+
+
+_packs = {}
+
+
+def getPack(pages=300):
+    """Bytes of a synthetic pack, built once per size"""
+    if pages not in _packs:
+        handle, path = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(handle)
+        try:
+            synthetic.build(path, pages)
+            with open(path, 'rb') as f:
+                _packs[pages] = f.read()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+    return _packs[pages]
+
+
+def editPack(data, pages):
+    """The pack with the pages of pages replaced by their new content, or
+    removed where that is None"""
+    output = io.BytesIO()
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar, \
+            tarfile.open(fileobj=output, mode='w:gz') as edited:
+        for info in tar:
+            pageId = info.name[len('php-chunked-xhtml/'):-len('.html')]
+            page = tar.extractfile(info).read()
+            if pageId in pages:
+                if pages[pageId] is None:
+                    continue
+                page = pages[pageId]
+                info.size = len(page)
+            edited.addfile(info, io.BytesIO(page))
+    return output.getvalue()
+
+
+class PackHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        data = server.data
+        start, end = 0, len(data) - 1
+        m = re.match('bytes=(\\d+)-(\\d*)$', self.headers.get('Range') or '')
+        if m and server.ranges:
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        body = data[start:end + 1]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"%d"' % len(data))
+        self.end_headers()
+        if server.drops and len(body) > server.dropAfter:
+            # A flaky proxy, the connection goes away halfway
+            server.drops -= 1
+            self.wfile.write(body[:server.dropAfter])
+            self.wfile.flush()
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+
+
+class PackServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    """Serves data at any path, with or without ranges, and drops the
+    connection after dropAfter bytes of the next drops responses"""
+
+    daemon_threads = True
+
+    def __init__(self, data, ranges=True, drops=0, dropAfter=0):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), PackHandler)
+        self.data = data
+        self.ranges = ranges
+        self.drops = drops
+        self.dropAfter = dropAfter
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/php_manual_%s.tar.gz' % (self.server_address[1], languageName)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,99 @@
+"""Language pack downloads against a local HTTP server
+
+    python3 -m unittest discover tests
+"""
+
+import os
+import unittest
+import unittest.mock
+
+import support
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docphp = support.loadDocphp()
+        self.filename = self.docphp.getTarGzPath(support.languageName) + '.downloading'
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+        support.removeCache(self.docphp)
+
+    def serve(self, data, **options):
+        self.server = support.PackServer(data, **options)
+        return self.server.url
+
+    def assertDownloaded(self, data):
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_download(self):
+        data = support.getPack()
+        meta = self.docphp.downloadFile(self.serve(data), self.filename)
+        self.assertDownloaded(data)
+        self.assertEqual(meta["etag"], '"%d"' % len(data))
+
+    def test_resumes_after_dropped_connections(self):
+        data = support.getPack()
+        url = self.serve(data, drops=3, dropAfter=len(data) // 5)
+        self.docphp.downloadFile(url, self.filename)
+        self.assertDownloaded(data)
+        # Every retry continues from what is on disk
+        self.assertEqual(self.server.requests[2:], ['bytes=%d-%d' % (len(data) // 5 * number, len(data) - 1)
+                                                    for number in range(1, 4)])
+
+    def test_resumes_a_leftover_download(self):
+        data = support.getPack()
+        with open(self.filename, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        self.docphp.downloadFile(self.serve(data), self.filename)
+        self.assertDownloaded(data)
+        self.assertEqual(self.server.requests[-1], 'bytes=%d-%d' % (len(data) // 2, len(data) - 1))
+
+    def test_restarts_without_ranges(self):
+        data = support.getPack()
+        # The probe gets the whole pack too, so it takes the first drop
+        url = self.serve(data, ranges=False, drops=2, dropAfter=len(data) // 3)
+        self.docphp.downloadFile(url, self.filename)
+        self.assertDownloaded(data)
+
+    def test_parallel_segments(self):
+        data = support.getPack(1500)
+        self.assertGreater(len(data), 1048576)
+        self.docphp.downloadFile(self.serve(data, drops=2, dropAfter=65536), self.filename, connections=4)
+        self.assertDownloaded(data)
+        self.assertEqual(len([request for request in self.server.requests if request != 'bytes=0-0']), 4 + 2)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.filename))), [os.path.basename(self.filename)])
+
+    def test_rejects_a_corrupt_download(self):
+        data = bytearray(support.getPack())
+        data[len(data) // 2] ^= 0xff
+        with self.assertRaises(IOError):
+            self.docphp.downloadFile(self.serve(bytes(data)), self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_rejects_a_truncated_download(self):
+        data = support.getPack()
+        with self.assertRaises(IOError):
+            self.docphp.downloadFile(self.serve(data[:-1024]), self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_checkout(self):
+        data = support.getPack()
+        url = self.serve(data, drops=1, dropAfter=len(data) // 2)
+        command = self.docphp.DocphpCheckoutLanguageCommand(self.docphp.currentView)
+        with unittest.mock.patch.object(self.docphp, 'getPackUrl', lambda languageName: url):
+            self.assertTrue(command.downloadLanguageGZ(support.languageName))
+        with open(self.docphp.getTarGzPath(support.languageName), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        # The page store is built on the way
+        self.assertTrue(os.path.isfile(self.docphp.getPageStorePath(support.languageName)))
+        self.assertTrue(self.docphp.loadLanguage(support.languageName))
+        self.assertIn('strlen', self.docphp.getSymbolDescription('strlen')[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Refreshing a loaded language pack against a local HTTP server
+
+    python3 -m unittest discover tests
+"""
+
+import unittest
+import unittest.mock
+
+import support
+
+
+class RefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docphp = support.loadDocphp()
+        self.server = support.PackServer(support.getPack())
+        patch = unittest.mock.patch.object(self.docphp, 'getPackUrl', lambda languageName: self.server.url)
+        patch.start()
+        self.addCleanup(patch.stop)
+        command = self.docphp.DocphpCheckoutLanguageCommand(self.docphp.currentView)
+        self.assertTrue(command.downloadLanguageGZ(support.languageName))
+        self.assertTrue(self.docphp.loadLanguage(support.languageName))
+
+    def tearDown(self):
+        self.server.stop()
+        support.removeCache(self.docphp)
+
+    def lookUp(self, symbol):
+        resolved = self.docphp.resolveIdentifier(symbol, support.languageName)
+        return resolved and self.docphp.getSymbolDescription(resolved[1])[1]
+
+    def panel(self, symbol):
+        description = self.docphp.getSymbolDescription(symbol)[1]
+        return ''.join(self.docphp.formatPanelChunks(description, symbol, support.languageName))
+
+    def during(self, function, lookups):
+        # Looks up strlen on every call of function: on the old index while
+        # the new files are moved in and on the new one after the swap
+        def call(*args):
+            lookups.append((function.__name__, self.lookUp('strlen')))
+            return function(*args)
+        return call
+
+    def test_refresh(self):
+        symbols = self.docphp.docphp_languages[support.languageName]["symbolList"]
+        removed = [key for key in symbols.keys() if key.startswith('function.') and key != 'function.strlen'][-1]
+        self.assertIn('strlen', self.lookUp('strlen'))
+        self.assertTrue(self.lookUp(removed))
+        self.assertNotIn('Refreshed', self.panel('function.strlen'))
+        page = b'<html><body><h1 class="refname">strlen</h1><p class="refpurpose">Refreshed</p></body></html>'
+        self.server.data = support.editPack(support.getPack(), {'function.strlen': page, removed: None})
+
+        lookups = []
+        updates = []
+        with unittest.mock.patch.object(self.docphp, 'getAliasIndex', self.during(self.docphp.getAliasIndex, lookups)), \
+                unittest.mock.patch.object(self.docphp, 'compactSharedStore', self.during(self.docphp.compactSharedStore, lookups)), \
+                unittest.mock.patch.object(self.docphp.SearchIndex, 'update', lambda index, *args: updates.append(args)):
+            self.assertTrue(self.docphp.refreshLanguage(support.languageName))
+
+        self.assertEqual(updates, [(['function.strlen'], [removed])])
+        self.assertEqual([name for name, description in lookups], ['getAliasIndex', 'compactSharedStore'])
+        self.assertIn('Refreshed', lookups[1][1])
+        self.assertIn('Refreshed', self.lookUp('strlen'))
+        self.assertIsNone(self.lookUp(removed))
+        # Cached panels of changed pages are dropped with their definitions
+        self.assertIn('Refreshed', self.panel('function.strlen'))
+
+    def test_checkout_again(self):
+        page = b'<html><body><h1 class="refname">strlen</h1><p class="refpurpose">Refreshed</p></body></html>'
+        self.server.data = support.editPack(support.getPack(), {'function.strlen': page})
+        lookups = []
+        command = self.docphp.DocphpCheckoutLanguageCommand(self.docphp.currentView)
+        with unittest.mock.patch.object(self.docphp, 'getAliasIndex', self.during(self.docphp.getAliasIndex, lookups)), \
+                unittest.mock.patch.object(self.docphp, 'compactSharedStore', self.during(self.docphp.compactSharedStore, lookups)):
+            self.assertTrue(command.downloadLanguageGZ(support.languageName))
+        self.assertEqual([name for name, description in lookups], ['getAliasIndex', 'compactSharedStore'])
+        self.assertIn('Refreshed', lookups[1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Startup and loading languages in the background
+
+    python3 -m unittest discover tests
+"""
+
+import os
+import threading
+import time
+import unittest
+import unittest.mock
+import zipfile
+
+import support
+import sublime
+
+
+def waitFor(condition, timeout=30):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class StartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docphp = support.loadDocphp()
+        with open(self.docphp.getTarGzPath(support.languageName), 'wb') as f:
+            f.write(support.getPack())
+        self.view = sublime.View('strlen', 0)
+        self.view.run_command = unittest.mock.Mock()
+        self.docphp.currentView = self.view
+
+    def tearDown(self):
+        support.removeCache(self.docphp)
+
+    def gateLoading(self):
+        # Holds every load until the returned event is set
+        gate = threading.Event()
+        loadLanguage = self.docphp.loadLanguage
+
+        def load(languageName=None):
+            gate.wait(30)
+            return loadLanguage(languageName)
+
+        patch = unittest.mock.patch.object(self.docphp, 'loadLanguage', load)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(gate.set)
+        return gate
+
+    def test_plugin_loaded_leaves_loading_to_the_background(self):
+        gate = self.gateLoading()
+        self.docphp.plugin_loaded()
+        self.assertLess(self.docphp.startupTimes["plugin_loaded"], 0.25)
+        waitFor(lambda: support.languageName in self.docphp.languageLoads)
+        future = self.docphp.languageLoads[support.languageName]
+        self.assertFalse(future.done())
+        gate.set()
+        self.assertTrue(future.result(30))
+        self.assertIn("start_up", self.docphp.startupTimes)
+        self.assertIn(support.languageName, self.docphp.startupTimes)
+
+    def test_only_background_threads_wait(self):
+        gate = self.gateLoading()
+        self.docphp.loadLanguageAsync(support.languageName)
+        self.assertIsNone(self.docphp.waitForLanguage(support.languageName))
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.docphp.waitForLanguage(support.languageName)))
+        thread.start()
+        gate.set()
+        thread.join(30)
+        self.assertEqual(results, [True])
+        self.assertTrue(self.docphp.waitForLanguage(support.languageName))
+
+    def test_show_definition_runs_again_once_loaded(self):
+        gate = self.gateLoading()
+        command = self.docphp.DocphpShowDefinitionCommand(self.view)
+        with self.assertLogs('docphp', 'INFO') as logs:
+            command.run(None, symbol='strlen')
+        self.assertIn('loading ' + support.languageName + ' manual', logs.output[0])
+        self.assertFalse(self.view.run_command.called)
+        gate.set()
+        waitFor(lambda: self.view.run_command.called)
+        self.view.run_command.assert_called_once_with('docphp_show_definition', {"symbol": 'strlen', "force": False})
+
+    def test_failed_load_is_reported_and_not_retried(self):
+        with open(self.docphp.getTarGzPath(support.languageName), 'wb') as f:
+            f.write(b'not a pack' * 1000)
+        gate = self.gateLoading()
+        languages = {support.languageName: {"name": 'Test', "nativeName": 'Test'}}
+        with unittest.mock.patch.object(self.docphp, 'getAllLanguages', lambda: languages), \
+                self.assertLogs('docphp', 'INFO') as logs:
+            self.docphp.DocphpShowDefinitionCommand(self.view).run(None, symbol='strlen')
+            gate.set()
+            waitFor(lambda: any('has not yet installed' in line for line in logs.output))
+            time.sleep(0.2)
+        self.assertFalse(self.view.run_command.called)
+        self.assertEqual(len([line for line in logs.output if 'has not yet installed' in line]), 1)
+
+    def test_prebuilt_index_is_read_in_the_background(self):
+        os.makedirs(self.docphp.getPrebuiltPath())
+        with zipfile.ZipFile(self.docphp.getPrebuiltPath() + support.languageName + '-test-0000.zip', 'w') as batch:
+            batch.writestr('strlen.html', 'prebuilt')
+        gate = threading.Event()
+        loadPrebuiltIndex = self.docphp.loadPrebuiltIndex
+
+        def load():
+            gate.wait(30)
+            return loadPrebuiltIndex()
+
+        with unittest.mock.patch.object(self.docphp, 'loadPrebuiltIndex', load):
+            self.assertIsNone(self.docphp.getPrebuilt('strlen.html'))
+            gate.set()
+            waitFor(lambda: self.docphp.prebuiltIndex is not None)
+        self.assertEqual(self.docphp.getPrebuilt('strlen.html'), 'prebuilt')
+
+
+if __name__ == '__main__':
+    unittest.main()